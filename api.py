@@ -1,41 +1,89 @@
 import datetime
 from typing import Optional
 
+import numpy as np
+import pandas as pd
 from pandas import Series
 from pandas.core.interchange.dataframe_protocol import DataFrame
 
-from myDB import MyDB
+import tracing
+from myDB import MyDB, open_db, release_db
 from pathlib import Path
 
 
+def _valid_range(valid_data: datetime.date, valid_time: Optional[datetime.time]) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    :return: the valid time range of a query, the whole day if `valid_time` is None
+    """
+    if valid_time:
+        valid_start = datetime.datetime.combine(valid_data, valid_time)
+        valid_end = datetime.datetime.combine(valid_data, valid_time)
+    else:
+        valid_start = datetime.datetime.combine(valid_data, datetime.time.min)
+        valid_end = datetime.datetime.combine(valid_data, datetime.time.max)
+    return valid_start, valid_end
+
+
+def _trans_end(end_date: Optional[datetime.date], end_time: Optional[datetime.time]) -> Optional[datetime.datetime]:
+    """
+    :return: the end of the transaction time range of a query, None if there is no end date
+    """
+    if end_date is None:
+        return None
+    return datetime.datetime.combine(end_date, end_time if end_time is not None else datetime.time.max)
+
+
+def to_rows(df: DataFrame) -> list[list]:
+    """
+    :param df: rows of the db
+    :return: the rows as json serializable lists, the times as iso strings and the nulls as None
+    """
+    columns = []
+    for col in df.columns:
+        values = df[col].values
+        if values.dtype.kind == "M":
+            values = values.astype("datetime64[ns]")
+            # like Timestamp.isoformat, the microseconds only when there are
+            strings = np.where(values.view(np.int64) % 1_000_000_000 == 0,
+                               np.datetime_as_string(values, unit="s"), np.datetime_as_string(values, unit="us"))
+            values = np.where(np.isnat(values), None, strings.astype(object))
+        else:
+            values = np.where(pd.isna(values), None, values.astype(object))
+        columns.append(values.tolist())
+    return [list(row) for row in zip(*columns)]
+
+
 class API:
-    def __init__(self):
-        self.db = MyDB(Path("dbs/project_db_2025.xlsx"))
+    def __init__(self, db: Optional[MyDB] = None, partitions: Optional[int] = None):
+        """
+        :param db: the db to work with (a `MyDB` or a `PartitionedDB`), the shared db of dbs/project_db_2025.xlsx
+                   (see `open_db`) if None
+        :param partitions: the partitions of the shared db, see `open_db`
+        """
+        self._shared = db is None
+        self.db = open_db(Path("dbs/project_db_2025.xlsx"), partitions=partitions) if db is None else db
+
+    def close(self):
+        """
+        release the shared db, it is closed when no other user of the process holds it
+        """
+        if self._shared:
+            release_db(self.db)
 
+    @tracing.traced("api.get_history")
     def get_history(
             self, first_name: str, last_name: str, loinc: str,
             valid_data: datetime.date, valid_time: Optional[datetime.time],
             start_date: Optional[datetime.date], start_time: Optional[datetime.time],
             end_date: Optional[datetime.date], end_time: Optional[datetime.time],
     ):
-        if valid_time:
-            valid_start = datetime.datetime.combine(valid_data, valid_time)
-            valid_end = datetime.datetime.combine(valid_data, valid_time)
-        else:
-            valid_start = datetime.datetime.combine(valid_data, datetime.time.min)
-            valid_end = datetime.datetime.combine(valid_data, datetime.time.max)
-
-        valid_range = (valid_start, valid_end)
+        valid_range = _valid_range(valid_data, valid_time)
 
         start = None
         if start_date is not None:
             start = datetime.datetime.combine(start_date, start_time if start_time is not None else datetime.time.min)
 
-        end = None
-        if end_date is not None:
-            end = datetime.datetime.combine(end_date, end_time if end_time is not None else datetime.time.max)
-
-        trans_range = (start, end)
+        trans_range = (start, _trans_end(end_date, end_time))
 
         return self.db.get_history(
             first_name, last_name, loinc,
@@ -43,6 +91,7 @@ class API:
             range_trans=trans_range
         )
 
+    @tracing.traced("api.get_res")
     def get_res(
             self, first_name: str, last_name: str, loinc: str,
             valid_data: datetime.date, valid_time: Optional[datetime.time],
@@ -54,7 +103,22 @@ class API:
             return data.iloc[-1]
         return None # can be deleted but more explicitly is better
 
+    @tracing.traced("api.get_results_bulk")
+    def get_results_bulk(self, queries: list[tuple]) -> DataFrame:
+        """
+        `get_res` for many queries at once
+        :param queries: (first_name, last_name, loinc, valid_data, valid_time, trans_date, trans_time) of every query,
+                        like the arguments of `get_res`
+        :return: df with the result of the i-th query in the i-th row, all null if the query has no result
+        """
+        columns = {col: [] for col in ["First name", "Last name", "LOINC-NUM", "Valid start time", "Valid end time", "Transaction time"]}
+        for first_name, last_name, loinc, valid_data, valid_time, trans_date, trans_time in queries:
+            valid_start, valid_end = _valid_range(valid_data, valid_time)
+            for col, value in zip(columns, (first_name, last_name, loinc, valid_start, valid_end, _trans_end(trans_date, trans_time))):
+                columns[col].append(value)
+        return self.db.as_of_bulk(pd.DataFrame(columns))
 
+    @tracing.traced("api.update")
     def update(
            self, first_name: str, last_name: str, loinc: str,
            valid_data: datetime.date, valid_time: Optional[datetime.time],
@@ -77,6 +141,7 @@ class API:
             "new": new_row
         }
 
+    @tracing.traced("api.delete")
     def delete(
             self, first_name: str, last_name: str, loinc: str,
             valid_data: datetime.date, valid_time: Optional[datetime.time],
@@ -86,15 +151,118 @@ class API:
            valid_data, valid_time,
            trans_date, trans_time)
 
-    def get_all_first_names(self):
-        return sorted(set(self.db.df["First name"]))
+    @tracing.traced("api.update_many")
+    def update_many(self, updates: list[tuple]) -> dict:
+        """
+        `update` of many measurements at once, their current rows are found with one `get_results_bulk` and the new
+        rows are added with one `MyDB.add_rows`, so one undo removes all of them
+        :param updates: (first_name, last_name, loinc, valid_data, valid_time, trans_date, trans_time, value) of every
+                        update, like the arguments of `update` (a None value deletes the measurement)
+        :return: {
+                    "old": df with the current row of every changed measurement,
+                    "new": df with the new rows, one for every changed measurement,
+                    "missing": the indexes (in `updates`) of the updates without a current row,
+                    "superseded": the indexes (in `updates`) of the updates of a measurement that a later update in
+                                  `updates` changes too (the last update of a measurement wins, like sequential
+                                  `update` calls)
+                 }
+                 the index of "old" and "new" is the index of the update in `updates`
+        """
+        old = self.get_results_bulk([update[:7] for update in updates])
+        found = old["Valid start time"].notna().values
+        now = datetime.datetime.now()
 
-    def get_all_last_names(self):
-        return sorted(set(self.db.df["Last name"]))
+        # the updates that resolve to the same measurement would get the same transaction time, keep only the last
+        last_update = {}
+        for i in np.flatnonzero(found):
+            first_name, last_name, loinc = updates[i][:3]
+            last_update[(first_name, last_name, loinc, old["Valid start time"].iloc[i])] = i
+        changed = np.array(sorted(last_update.values()), dtype=np.int64)
 
-    def get_all_loinc(self):
-        return sorted(set(self.db.df["LOINC-NUM"]))
+        rows = []
+        for i in changed:
+            first_name, last_name, loinc, _, _, trans_date, trans_time, value = updates[i]
+            trans_datetime = now
+            if trans_date is not None:
+                trans_datetime = datetime.datetime.combine(
+                    trans_date,
+                    trans_time if trans_time is not None else datetime.time.max
+                )
+            rows.append((first_name, last_name, loinc, old["Valid start time"].iloc[i], trans_datetime, value,
+                         old["Unit"].iloc[i]))
+        new = self.db.add_rows(rows)
+        new.index = changed
+        return {
+            "old": old.iloc[changed],
+            "new": new,
+            "missing": np.flatnonzero(~found).tolist(),
+            "superseded": sorted(set(np.flatnonzero(found).tolist()) - set(changed.tolist()))
+        }
+
+    def delete_many(self, deletes: list[tuple]) -> dict:
+        """
+        `delete` of many measurements at once, like `update_many`
+        :param deletes: (first_name, last_name, loinc, valid_data, valid_time, trans_date, trans_time) of every delete
+        """
+        return self.update_many([(*delete, None) for delete in deletes])
+
+    @tracing.traced("api.aggregate")
+    def aggregate(
+            self, loinc: str, start_date: datetime.date, end_date: datetime.date, bucket: str = "1D",
+            trans_date: Optional[datetime.date] = None, trans_time: Optional[datetime.time] = None
+    ) -> DataFrame:
+        """
+        the count, mean, min and max of a test across all the patients, see `MyDB.aggregate`
+        :param loinc: the test
+        :param start_date: the first valid date
+        :param end_date: the last valid date
+        :param bucket: the length of the buckets, like "1h" or "1D"
+        :param trans_date: the date of the db to read, the latest version if None
+        :param trans_time: the time of the db to read, the end of `trans_date` if None
+        :return: df with a row for every bucket and unit with measurements
+        """
+        return self.db.aggregate(
+            loinc,
+            (datetime.datetime.combine(start_date, datetime.time.min), datetime.datetime.combine(end_date, datetime.time.max)),
+            bucket=bucket,
+            as_of=_trans_end(trans_date, trans_time)
+        )
 
+    def get_all_first_names(self, prefix: str = "", limit: Optional[int] = None) -> list[str]:
+        """
+        :param prefix: only the names that start with `prefix` (case sensitive)
+        :param limit: the max number of names, no limit if None
+        :return: the distinct first names in the db, sorted
+        """
+        return self.db.search_values("First name", prefix, limit)
+
+    def get_all_last_names(self, prefix: str = "", limit: Optional[int] = None) -> list[str]:
+        """
+        like `get_all_first_names` for the last names
+        """
+        return self.db.search_values("Last name", prefix, limit)
+
+    def get_all_loinc(self, prefix: str = "", limit: Optional[int] = None) -> list[str]:
+        """
+        like `get_all_first_names` for the loinc codes
+        """
+        return self.db.search_values("LOINC-NUM", prefix, limit)
+
+    @tracing.traced("api.loinc2name")
     def loinc2name(self, loinc: str) -> str:
         return self.db.get_name_by_loinc(loinc)
 
+    def loinc2names(self, loincs: list[str]) -> list[Optional[str]]:
+        return self.db.loinc_catalog.names(loincs)
+
+    def search_loinc(self, text: str, limit: int = 20, prefix: bool = False) -> list[tuple[str, str]]:
+        """
+        :param text: the text to search in the long common names of the loinc codes (case insensitive)
+        :param limit: the max number of results
+        :param prefix: search only names that start with `text`
+        :return: (code, name) of the matches, sorted by the name
+        """
+        if prefix:
+            return self.db.loinc_catalog.search_prefix(text, limit)
+        return self.db.loinc_catalog.search(text, limit)
+
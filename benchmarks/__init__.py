@@ -0,0 +1,6 @@
+"""
+benchmarks of the DB and the API on synthetic bitemporal data
+run with `python -m benchmarks --rows 100000`, the report is printed as json (see `benchmarks.scenarios.run`)
+"""
+from benchmarks.generator import generate
+from benchmarks.scenarios import SCENARIOS, run
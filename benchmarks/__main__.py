@@ -0,0 +1,27 @@
+import argparse
+import json
+import sys
+
+from benchmarks.scenarios import SCENARIOS, run
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="benchmarks", description="benchmark the db on synthetic data")
+    parser.add_argument("--rows", type=int, default=100_000, help="the number of rows of the db")
+    parser.add_argument("--seed", type=int, default=0, help="the seed of the data and the operations")
+    parser.add_argument("--ops", type=int, default=1000, help="the number of operations of every scenario")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), help="the scenarios to run, all by default")
+    parser.add_argument("--output", help="write the json report to this file instead of the stdout")
+    args = parser.parse_args()
+
+    report = run(args.rows, args.seed, args.scenarios, args.ops)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
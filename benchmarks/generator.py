@@ -0,0 +1,93 @@
+"""
+seeded generator of synthetic lab results: patients, LOINC tests and value histories with corrections and deletions
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+
+_FIRST_NAMES = ["Eyal", "Hana", "Eli", "Noa", "Yossi", "Maya", "David", "Sara", "Avi", "Tamar", "Moshe", "Rivka",
+                "Daniel", "Yael", "Omer", "Shira", "Itai", "Michal", "Amit", "Lior"]
+_LAST_NAMES = ["Levi", "Cohen", "Mizrahi", "Peretz", "Biton", "Dahan", "Avraham", "Friedman", "Azoulay", "Katz",
+               "Malka", "Amar", "Ohayon", "Hadad", "Gabay", "Ben David", "Shapiro", "Klein", "Call", "Segal"]
+# (code, unit, mean, standard deviation) of common tests
+_TESTS = [
+    ("2345-7", "mg/dL", 100.0, 20.0),     # glucose
+    ("2160-0", "mg/dL", 1.0, 0.3),        # creatinine
+    ("718-7", "g/dL", 14.0, 1.5),         # hemoglobin
+    ("6690-2", "10*3/uL", 7.0, 2.0),      # leukocytes
+    ("777-3", "10*3/uL", 250.0, 60.0),    # platelets
+    ("2951-2", "mmol/L", 140.0, 3.0),     # sodium
+    ("2823-3", "mmol/L", 4.2, 0.4),       # potassium
+    ("2093-3", "mg/dL", 190.0, 35.0),     # cholesterol
+    ("4548-4", "%", 5.6, 0.8),            # hemoglobin A1c
+    ("11218-5", "mg/L", 20.0, 10.0),      # microalbumin
+    ("1742-6", "U/L", 25.0, 10.0),        # alanine aminotransferase
+    ("3016-3", "mIU/L", 2.0, 1.0),        # thyrotropin
+]
+
+
+def patient_names(patients: int) -> tuple[list[str], list[str]]:
+    """
+    :return: the first and the last names of `patients` distinct patients
+    """
+    first_names, last_names = [], []
+    for i in range(patients):
+        first_names.append(_FIRST_NAMES[i % len(_FIRST_NAMES)])
+        round_, last = divmod(i // len(_FIRST_NAMES), len(_LAST_NAMES))
+        last_names.append(_LAST_NAMES[last] + (f" {round_}" if round_ else ""))
+    return first_names, last_names
+
+
+def generate(rows: int, seed: int = 0, patients: int | None = None, correction_rate: float = 0.1,
+             deletion_rate: float = 0.01, start: datetime.datetime = datetime.datetime(2018, 1, 1),
+             days: int = 365) -> pd.DataFrame:
+    """
+    :param rows: the number of rows
+    :param seed: the seed of the random generator, the same arguments give the same rows
+    :param patients: the number of patients, one per 200 rows if None
+    :param correction_rate: the number of corrections (a later transaction with another value) per measurement
+    :param deletion_rate: the number of deletions (a later transaction without value) per measurement
+    :param start: the first valid start time
+    :param days: the valid start times are in the `days` days from `start`
+    :return: df with the columns of the db, ordered by the transaction time
+    """
+    rng = np.random.default_rng(seed)
+    patients = patients or max(1, rows // 200)
+    first_names, last_names = patient_names(patients)
+    codes, units, means, deviations = (np.array(values, dtype=dtype)
+                                       for values, dtype in zip(zip(*_TESTS), (object, object, float, float)))
+
+    # the measurements, a few extra so there are `rows` rows after the corrections and the deletions
+    measurements = int(rows / (1 + correction_rate + deletion_rate) * 1.01) + 1
+    patient = rng.integers(patients, size=measurements)
+    test = rng.integers(len(_TESTS), size=measurements)
+    valid = np.datetime64(start, "s") + rng.integers(days * 24 * 60, size=measurements).astype("timedelta64[m]")
+    # a result is entered minutes to hours after the sample was taken
+    trans = valid + rng.exponential(120 * 60, size=measurements).astype("timedelta64[s]")
+    value = np.round(rng.normal(means[test], deviations[test]), 1)
+
+    def later_versions(rate: float, corrected: bool):
+        chosen = rng.choice(measurements, size=int(measurements * rate))
+        # a correction is entered hours to days after the result
+        later = trans[chosen] + rng.exponential(3 * 24 * 60 * 60, size=len(chosen)).astype("timedelta64[s]")
+        values = np.round(value[chosen] + rng.normal(0, deviations[test[chosen]] / 4), 1) if corrected else None
+        return chosen, later, values
+
+    corrections, correction_trans, correction_values = later_versions(correction_rate, True)
+    deletions, deletion_trans, _ = later_versions(deletion_rate, False)
+
+    index = np.concatenate([np.arange(measurements), corrections, deletions])
+    values = np.empty(len(index), dtype=object)
+    values[:measurements + len(corrections)] = np.concatenate([value, correction_values]).tolist()
+    df = pd.DataFrame({
+        "First name": np.array(first_names, dtype=object)[patient[index]],
+        "Last name": np.array(last_names, dtype=object)[patient[index]],
+        "LOINC-NUM": codes[test[index]],
+        "Value": values,
+        "Unit": units[test[index]],
+        "Valid start time": valid[index].astype("datetime64[ns]"),
+        "Transaction time": np.concatenate([trans, correction_trans, deletion_trans]).astype("datetime64[ns]"),
+    })
+    df = df.sort_values("Transaction time", kind="stable").head(rows)
+    return df.reset_index(drop=True)
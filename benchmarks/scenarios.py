@@ -0,0 +1,209 @@
+"""
+the benchmark scenarios, every scenario runs `ops` operations on a db of synthetic rows and reports their latencies
+"""
+import datetime
+import platform
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from api import API
+from benchmarks.generator import generate
+from myDB import MyDB
+
+try:
+    import resource
+except ImportError:  # not on windows
+    resource = None
+
+
+def _summary(latencies: list[float]) -> dict:
+    """
+    :param latencies: the seconds of every operation
+    :return: the number of operations, their total seconds, the operations per second and the latency percentiles
+             in milliseconds
+    """
+    latencies = np.array(latencies)
+    total = float(latencies.sum())
+    return {
+        "ops": len(latencies),
+        "seconds": total,
+        "throughput": len(latencies) / total if total > 0 else None,
+        "latency_ms": {
+            name: float(np.percentile(latencies, q)) * 1000 if len(latencies) else None
+            for name, q in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+        },
+    }
+
+
+def _timed(function: Callable, calls: list[tuple]) -> list[float]:
+    """
+    :return: the seconds of `function(*args)` for every args in `calls`
+    """
+    latencies = []
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def _sample(df: pd.DataFrame, rng: np.random.Generator, ops: int) -> pd.DataFrame:
+    """
+    :return: `ops` random rows of `df`
+    """
+    return df.iloc[rng.integers(len(df), size=ops)]
+
+
+def point_reads(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    `API.get_res` of existing measurements, as of now
+    """
+    rows = _sample(df, rng, ops)
+    return _summary(_timed(api.get_res, [
+        (row["First name"], row["Last name"], row["LOINC-NUM"],
+         row["Valid start time"].date(), row["Valid start time"].time(), None, None)
+        for _, row in rows.iterrows()
+    ]))
+
+
+def history_scans(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    `API.get_history` of a whole valid day over all the transaction time
+    """
+    rows = _sample(df, rng, ops)
+    return _summary(_timed(api.get_history, [
+        (row["First name"], row["Last name"], row["LOINC-NUM"],
+         row["Valid start time"].date(), None, datetime.date(1900, 1, 1), None, None, None)
+        for _, row in rows.iterrows()
+    ]))
+
+
+def time_machine(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    `API.get_res` of existing measurements as of a random time after they were entered
+    """
+    rows = _sample(df, rng, ops)
+    as_of = rows["Transaction time"] + pd.to_timedelta(rng.exponential(5 * 24 * 60 * 60, size=ops), unit="s")
+    return _summary(_timed(api.get_res, [
+        (row["First name"], row["Last name"], row["LOINC-NUM"],
+         row["Valid start time"].date(), None, trans.date(), trans.time())
+        for (_, row), trans in zip(rows.iterrows(), as_of)
+    ]))
+
+
+def bulk_reads(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    one `API.get_results_bulk` of `ops` point reads, the latencies are of the whole call
+    """
+    rows = _sample(df, rng, ops)
+    queries = [(row["First name"], row["Last name"], row["LOINC-NUM"],
+                row["Valid start time"].date(), row["Valid start time"].time(), None, None)
+               for _, row in rows.iterrows()]
+    summary = _summary(_timed(api.get_results_bulk, [(queries,)]))
+    summary["throughput"] = ops / summary["seconds"] if summary["seconds"] > 0 else None
+    return summary
+
+
+def update_bursts(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    `API.update` of existing measurements one after the other, then `MyDB.undo` of all of them (reported as "undo")
+    """
+    rows = _sample(df, rng, ops)
+    summary = _summary(_timed(api.update, [
+        (row["First name"], row["Last name"], row["LOINC-NUM"],
+         row["Valid start time"].date(), row["Valid start time"].time(), None, None, str(i))
+        for i, (_, row) in enumerate(rows.iterrows())
+    ]))
+    summary["undo"] = _summary(_timed(api.db.undo, [()] * ops))
+    return summary
+
+
+def cohort_aggregates(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    `API.aggregate` by hour of a random test over a random month, as of a random time (at most 20 times)
+    """
+    calls = []
+    for _ in range(min(ops, 20)):
+        row = df.iloc[int(rng.integers(len(df)))]
+        start = row["Valid start time"].date()
+        as_of = row["Transaction time"] + pd.Timedelta(days=float(rng.exponential(30)))
+        calls.append((row["LOINC-NUM"], start, start + datetime.timedelta(days=30), "1h", as_of.date(), as_of.time()))
+    return _summary(_timed(api.aggregate, calls))
+
+
+def startup(api: API, df: pd.DataFrame, rng: np.random.Generator, ops: int) -> dict:
+    """
+    `MyDB.from_snapshot` and the first query, from a snapshot of the db (at most 3 times)
+    """
+    row = df.iloc[int(rng.integers(len(df)))]
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "db.snapshot"
+        api.db.save_snapshot(path)
+
+        def start():
+            db = MyDB.from_snapshot(path)
+            db.get_history(row["First name"], row["Last name"], row["LOINC-NUM"],
+                           (row["Valid start time"], row["Valid start time"]))
+
+        return _summary(_timed(start, [()] * min(ops, 3)))
+
+
+SCENARIOS: dict[str, Callable[[API, pd.DataFrame, np.random.Generator, int], dict]] = {
+    "point_reads": point_reads,
+    "history_scans": history_scans,
+    "time_machine": time_machine,
+    "bulk_reads": bulk_reads,
+    "update_bursts": update_bursts,
+    "cohort_aggregates": cohort_aggregates,
+    "startup": startup,
+}
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on mac
+    return peak / (1 << 20) if platform.system() == "Darwin" else peak / (1 << 10)
+
+
+def run(rows: int, seed: int = 0, scenarios: Optional[list[str]] = None, ops: int = 1000,
+        loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv")) -> dict:
+    """
+    :param rows: the number of rows of the synthetic db (see `generate`)
+    :param seed: the seed of the data and of the operations
+    :param scenarios: the names of the scenarios to run (see `SCENARIOS`), all if None
+    :param ops: the number of operations of every scenario
+    :param loinc_code_db_path: the path to the csv of the loinc code
+    :return: json serializable report: the arguments, the seconds to generate and load the data, the summary of
+             every scenario (see `_summary`), the peak RSS of the process in MB and the versions
+    """
+    scenarios = list(SCENARIOS) if scenarios is None else scenarios
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        raise ValueError(f"unknown scenarios {unknown}, the scenarios are {list(SCENARIOS)}")
+
+    start = time.perf_counter()
+    df = generate(rows, seed)
+    generate_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    api = API(MyDB.from_frame(df, loinc_code_db_path))
+    load_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    results = {name: SCENARIOS[name](api, df, rng, ops) for name in scenarios}
+    return {
+        "rows": rows,
+        "seed": seed,
+        "ops": ops,
+        "generate_seconds": generate_seconds,
+        "load_seconds": load_seconds,
+        "scenarios": results,
+        "peak_rss_mb": _peak_rss_mb(),
+        "versions": {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__},
+    }
@@ -0,0 +1,213 @@
+import bisect
+import threading
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+import snapshot
+
+
+def cache_path(csv_path: Path) -> Path:
+    """
+    :param csv_path: the path to the csv of the loinc code
+    :return: the path of the binary cache of the catalog, beside the csv
+    """
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + ".cache")
+
+
+def _build(codes: Sequence[str], names: Sequence[str]) -> dict[str, np.ndarray]:
+    """
+    :return: the arrays of the catalog:
+             codes - the codes sorted (utf-8 bytes)
+             offsets, names - the name of codes[i] is names[offsets[i]:offsets[i + 1]] (utf-8), empty if missing
+             search_starts, search_text - the lower case names, sorted, one name per line (utf-8),
+                                          the j-th name starts at search_starts[j]
+             search_codes - the index in `codes` of the j-th lower case name
+    """
+    catalog: dict[str, str] = {}
+    for code, name in zip(codes, names):
+        catalog.setdefault(str(code), name if isinstance(name, str) else "")
+    sorted_codes = sorted(catalog)
+
+    encoded = [catalog[code].encode("utf-8") for code in sorted_codes]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in encoded], out=offsets[1:])
+
+    by_name = sorted((catalog[code].lower(), i) for i, code in enumerate(sorted_codes) if catalog[code])
+    lower = [(name + "\n").encode("utf-8") for name, _ in by_name]
+    search_starts = np.zeros(len(lower) + 1, dtype=np.int64)
+    np.cumsum([len(name) for name in lower], out=search_starts[1:])
+
+    return {
+        "codes": np.array([code.encode("utf-8") for code in sorted_codes], dtype=bytes),
+        "offsets": offsets,
+        "names": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "search_starts": search_starts,
+        "search_text": np.frombuffer(b"".join(lower), dtype=np.uint8),
+        "search_codes": np.array([i for _, i in by_name], dtype=np.int64),
+    }
+
+
+class _LowerNames:
+    """
+    the sorted lower case names of the catalog as a sequence, for bisect
+    """
+    def __init__(self, catalog: "LoincCatalog"):
+        self._catalog = catalog
+
+    def __len__(self) -> int:
+        return len(self._catalog._data["search_codes"])
+
+    def __getitem__(self, j: int) -> str:
+        return self._catalog._lower_name(j)
+
+
+class LoincCatalog:
+    """
+    the LOINC codes and their long common names
+    the catalog is kept in a few flat arrays (sorted codes, an offsets array and one bytes blob for the names) that
+    are memory-mapped from a cache file, names that were looked up are memoized so repeated lookups are O(1)
+    """
+    def __init__(self, codes: Sequence[str], names: Sequence[str]):
+        """
+        :param codes: the LOINC codes
+        :param names: the long common name of every code, if a code appears more than once the first name is used
+        """
+        self._csv_path: Optional[Path] = None
+        self._arrays: Optional[dict[str, np.ndarray]] = _build(codes, names)
+        self._load_lock = threading.Lock()
+        self._memo: dict[str, Optional[str]] = {}
+        self._text: Optional[bytes] = None
+
+    @classmethod
+    def from_csv(cls, path: Path) -> "LoincCatalog":
+        """
+        the catalog is loaded on first use, from the cache beside the csv if it is newer than the csv, otherwise
+        the csv is read and the cache is written
+        :param path: the path to the csv of the loinc code (LoincTableCore.csv)
+        """
+        catalog = cls.__new__(cls)
+        catalog._csv_path = Path(path)
+        catalog._arrays = None
+        catalog._load_lock = threading.Lock()
+        catalog._memo = {}
+        catalog._text = None
+        return catalog
+
+    @property
+    def _data(self) -> dict[str, np.ndarray]:
+        if self._arrays is None:
+            with self._load_lock:
+                if self._arrays is None:
+                    self._arrays = self._load()
+        return self._arrays
+
+    def _load(self) -> dict[str, np.ndarray]:
+        path = cache_path(self._csv_path)
+        if snapshot.is_fresh(path, self._csv_path):
+            arrays, _ = snapshot.load(path)
+            return arrays
+
+        df = pd.read_csv(self._csv_path, usecols=['LOINC_NUM', 'LONG_COMMON_NAME'], dtype=str)
+        arrays = _build(df['LOINC_NUM'].tolist(), df['LONG_COMMON_NAME'].tolist())
+        try:
+            snapshot.save(path, arrays, {})
+        except OSError:
+            pass  # the cache only makes the next start faster
+        return arrays
+
+    def __len__(self) -> int:
+        return len(self._data["codes"])
+
+    def __contains__(self, code: str) -> bool:
+        return self._find(code) is not None
+
+    def _find(self, code: str) -> Optional[int]:
+        """
+        :return: the index of `code` in the sorted codes, None if there is no such code
+        """
+        codes = self._data["codes"]
+        key = str(code).encode("utf-8")
+        i = int(np.searchsorted(codes, key))
+        if i < len(codes) and codes[i] == key:
+            return i
+        return None
+
+    def _name_at(self, i: int) -> Optional[str]:
+        offsets = self._data["offsets"]
+        name = self._data["names"][offsets[i]:offsets[i + 1]].tobytes().decode("utf-8")
+        return name or None
+
+    def _lower_name(self, j: int) -> str:
+        starts = self._data["search_starts"]
+        return self._data["search_text"][starts[j]:starts[j + 1] - 1].tobytes().decode("utf-8")
+
+    def name(self, code: str) -> Optional[str]:
+        """
+        :return: the long common name of `code`, None if there is no such code (or it has no name)
+        """
+        if code not in self._memo:
+            i = self._find(code)
+            self._memo[code] = None if i is None else self._name_at(i)
+        return self._memo[code]
+
+    def names(self, codes: Iterable[str]) -> list[Optional[str]]:
+        """
+        :return: the long common name of every code in `codes` (None for unknown codes)
+        """
+        codes = list(codes)
+        sorted_codes = self._data["codes"]
+        if len(codes) == 0 or len(sorted_codes) == 0:
+            return [None] * len(codes)
+
+        keys = np.array([str(code).encode("utf-8") for code in codes], dtype=bytes)
+        found = np.minimum(np.searchsorted(sorted_codes, keys), len(sorted_codes) - 1)
+        return [self._name_at(i) if sorted_codes[i] == key else None for i, key in zip(found, keys)]
+
+    def search_prefix(self, prefix: str, limit: int = 20) -> list[tuple[str, str]]:
+        """
+        :param prefix: the beginning of the name (case insensitive)
+        :param limit: the max number of results
+        :return: (code, name) of the names that start with `prefix`, sorted by the name
+        """
+        prefix = prefix.lower()
+        names = _LowerNames(self)
+        results = []
+        for j in range(bisect.bisect_left(names, prefix), len(names)):
+            if len(results) == limit or not names[j].startswith(prefix):
+                break
+            results.append(self._result(j))
+        return results
+
+    def search(self, text: str, limit: int = 20) -> list[tuple[str, str]]:
+        """
+        :param text: part of the name (case insensitive)
+        :param limit: the max number of results
+        :return: (code, name) of the names that contain `text`, sorted by the name
+        """
+        text = text.lower()
+        if not text or "\n" in text:
+            return []
+        if self._text is None:
+            self._text = self._data["search_text"].tobytes()
+
+        starts = self._data["search_starts"]
+        pattern = text.encode("utf-8")
+        results = []
+        i = self._text.find(pattern)
+        while i != -1 and len(results) < limit:
+            j = int(np.searchsorted(starts, i, side="right")) - 1
+            results.append(self._result(j))
+            # continue after the end of this name
+            i = self._text.find(pattern, starts[j + 1])
+        return results
+
+    def _result(self, j: int) -> tuple[str, str]:
+        """
+        :return: (code, name) of the j-th lower case name
+        """
+        i = self._data["search_codes"][j]
+        return self._data["codes"][i].decode("utf-8"), self._name_at(i)
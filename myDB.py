@@ -1,10 +1,21 @@
+import bisect
+import copy
 import datetime
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional, Union
 
+import snapshot
+import tracing
+import wal
+from loinc_catalog import LoincCatalog
 from pandas.core.interchange.dataframe_protocol import DataFrame
 
 
@@ -19,50 +30,1472 @@ def _get_time(time: Optional[datetime.datetime]) -> datetime.datetime:
     else:
         return time
 
+_logger = logging.getLogger(__name__)
+
+_COLUMNS = ["First name", "Last name", "LOINC-NUM", "Value", "Unit", "Valid start time", "Transaction time"]
+_KEY_COLUMNS = ["First name", "Last name", "LOINC-NUM"]
+_TIME_COLUMNS = ["Valid start time", "Transaction time"]
+# the string columns that are stored as int32 codes into a `_Dictionary`
+_CODED_COLUMNS = ["First name", "Last name", "LOINC-NUM", "Unit"]
+_MINUTE_NS = 60 * 1_000_000_000
+# the transaction end of the latest version of a group
+_NO_END = np.iinfo(np.int64).max
+# a checkpoint is started in the background when the write-ahead log has this many records
+_CHECKPOINT_RECORDS = 1000
+# the default max bytes of the results in the result cache of `get_history`
+_CACHE_BYTES = 64 << 20
+# the fanout of the hash trie of the changed blocks of `_Blocks`
+_FANOUT = 64
+
+
+def _floor_minute(time: datetime.datetime) -> int:
+    """
+    :param time: the datetime
+    :return: the minutes since the epoch of `time` truncated to the minute
+    """
+    return pd.Timestamp(time).value // _MINUTE_NS
+
+
+def _ceil_minute(time: datetime.datetime) -> int:
+    """
+    :param time: the datetime
+    :return: the minutes since the epoch of `time` rounded up to the minute
+    """
+    return -(-pd.Timestamp(time).value // _MINUTE_NS)
+
+
+def _to_minutes(times: pd.Series) -> np.ndarray:
+    """
+    :param times: datetime64[ns] series
+    :return: int64 array of the minutes since the epoch of `times` truncated to the minute
+    """
+    return times.values.view(np.int64) // _MINUTE_NS
+
+
+def _row_series(row: tuple, name: int) -> pd.Series:
+    """
+    :param row: the values of a row, ordered as `_COLUMNS`
+    :param name: the name (index label) for the row
+    :return: the row like a row of the df (the times as Timestamps)
+    """
+    values = [pd.Timestamp(value) if col in _TIME_COLUMNS else value for col, value in zip(_COLUMNS, row)]
+    return pd.Series(values, index=_COLUMNS, name=name, dtype=object)
+
+
+def _encode_row(row: tuple) -> list:
+    """
+    :param row: the values of a row, ordered as `_COLUMNS`
+    :return: the row as json serializable list (the times as iso strings)
+    """
+    return [
+        pd.Timestamp(value).isoformat() if col in _TIME_COLUMNS else
+        value.item() if isinstance(value, np.generic) else value
+        for col, value in zip(_COLUMNS, row)
+    ]
+
+
+def _decode_row(row: list) -> tuple:
+    """
+    :param row: row encoded with `_encode_row`
+    :return: the values of the row, ordered as `_COLUMNS` (a value of a type the snapshots can't keep, logged before
+             the values were checked, is coerced like in `ingest`)
+    """
+    return tuple(pd.Timestamp(value) if col in _TIME_COLUMNS else _coerce_value(value) if col == "Value" else value
+                 for col, value in zip(_COLUMNS, row))
+
+
+def _check_value(value):
+    """
+    :raise TypeError: if `value` is not one of the types of the "Value" column (None, int, float or str)
+    """
+    if value is None or isinstance(value, str):
+        return
+    if isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, float, np.integer, np.floating)):
+        raise TypeError(f"a value must be None, int, float or str, got {value!r} of type {type(value).__name__}")
+
+
+class _Column:
+    """
+    growable numpy array, the capacity is doubled when it is full so append is amortized O(1)
+    the values that were in the column are never overwritten in place (a reader may hold a view on them), an append
+    after a pop copies the array first
+    """
+    def __init__(self, values: np.ndarray):
+        """
+        :param values: the initial values of the column
+        """
+        self._data = values
+        self._size = len(values)
+        # the slots of `_data` below `_high` were used, a view on them may exist
+        self._high = self._size
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        :return: a view on the values of the column
+        """
+        return self._data[:self._size]
+
+    def append(self, value):
+        if self._size == len(self._data) or self._size < self._high:
+            capacity = max(16, 2 * len(self._data)) if self._size == len(self._data) else len(self._data)
+            data = np.empty(capacity, dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+            self._high = self._size
+        self._data[self._size] = value
+        self._size += 1
+        self._high = max(self._high, self._size)
+
+    def pop(self):
+        self._size -= 1
+        return self._data[self._size]
+
+
+class _SplitArray:
+    """
+    an immutable array of a base array and a tail, read like one array by positions without concatenating them
+    """
+    def __init__(self, base: np.ndarray, tail: np.ndarray):
+        self.base = base
+        self.tail = tail
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.tail)
+
+    def __getitem__(self, positions: np.ndarray) -> np.ndarray:
+        in_base = positions < len(self.base)
+        if in_base.all():
+            return self.base[positions]
+        result = np.empty(len(positions), dtype=self.base.dtype)
+        result[in_base] = self.base[positions[in_base]]
+        result[~in_base] = self.tail[positions[~in_base] - len(self.base)]
+        return result
+
+    @property
+    def nbytes(self) -> int:
+        return self.base.nbytes + self.tail.nbytes
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        :return: the whole array, a copy if the tail isn't empty
+        """
+        return self.base if len(self.tail) == 0 else np.concatenate([self.base, self.tail])
+
+
+class _SplitColumn:
+    """
+    a column of the db split like `_frame` and `_AppendBuffer`: an immutable base array for the rows of `_frame` and a
+    growable tail for the appended rows, the tail is folded into the base on merge
+    a pop cuts the last row off the tail, or off the base (a view) if the tail is empty, so an append after an undo only
+    copies the tail and never the base
+    """
+    def __init__(self, values: np.ndarray):
+        """
+        :param values: the initial values of the column
+        """
+        self._base = values
+        self._tail = _Column(np.empty(0, dtype=values.dtype))
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._tail)
+
+    def view(self) -> _SplitArray:
+        """
+        :return: the current values of the column, that the later changes don't change
+        """
+        return _SplitArray(self._base, self._tail.values)
+
+    def append(self, value):
+        self._tail.append(value)
+
+    def pop(self):
+        if len(self._tail) > 0:
+            return self._tail.pop()
+        value = self._base[-1]
+        self._base = self._base[:-1]
+        return value
+
+    def merge(self, values: Optional[np.ndarray] = None):
+        """
+        fold the tail into the base
+        :param values: values to add after the tail
+        """
+        parts = [self._tail.values] if len(self._tail) > 0 else []
+        parts += [values] if values is not None else []
+        if parts:
+            self._base = np.concatenate([self._base, *parts])
+            self._tail = _Column(np.empty(0, dtype=self._base.dtype))
+
+
+class _Dictionary:
+    """
+    dictionary encoding of a string column, every distinct value gets an int code and new values get the next code
+    """
+    def __init__(self, values: list):
+        """
+        :param values: the values of the dictionary, the code of values[i] is i
+        """
+        self._values = _Column(np.array(values, dtype=object))
+        self._codes = {value: code for code, value in enumerate(values)}
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @property
+    def values(self) -> list:
+        return self._values.values.tolist()
+
+    def code(self, value) -> Optional[int]:
+        """
+        :return: the code of `value`, None if it is not in the dictionary
+        """
+        return self._codes.get(value)
+
+    def encode(self, value) -> int:
+        """
+        :return: the code of `value`, `value` is added to the dictionary if it is new
+        """
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._values)
+            self._values.append(value)
+        return code
+
+    def encode_all(self, values: np.ndarray) -> np.ndarray:
+        """
+        :return: int32 array of the codes of `values`, the new values are added to the dictionary
+        """
+        inverse, uniques = pd.factorize(values, use_na_sentinel=False)
+        return np.array([self.encode(value) for value in uniques], dtype=np.int32)[inverse]
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        """
+        :return: object array of the values of `codes`
+        """
+        return self._values.values[codes]
+
+    def codes(self, values) -> np.ndarray:
+        """
+        :return: int64 array of the codes of `values`, -1 for the values that are not in the dictionary
+        """
+        return np.fromiter((self._codes.get(value, -1) for value in values), dtype=np.int64, count=len(values))
+
+
+class _DistinctValues:
+    """
+    the sorted distinct values of a coded column, kept up to date by the writer
+    the number of rows of every code is counted so a value is dropped when its last row is undone. a new value is
+    inserted into a copy of the sorted list, so a reader can keep using the list it has while the writer changes it
+    """
+    def __init__(self, dictionary: _Dictionary, codes: np.ndarray):
+        """
+        :param dictionary: the dictionary of the column
+        :param codes: the codes of the column in all the rows of the db
+        """
+        self._dictionary = dictionary
+        self._counts: list[int] = np.bincount(codes, minlength=len(dictionary)).tolist()
+        self.values: list = sorted(value for value, count in zip(dictionary.values, self._counts) if count > 0)
+
+    def add(self, code: int):
+        """
+        a row with `code` was added
+        """
+        if code >= len(self._counts):
+            self._counts.extend([0] * (code + 1 - len(self._counts)))
+        if self._counts[code] == 0:
+            value = self._dictionary.decode(np.array([code]))[0]
+            i = bisect.bisect_left(self.values, value)
+            self.values = self.values[:i] + [value] + self.values[i:]
+        self._counts[code] += 1
+
+    def remove(self, code: int):
+        """
+        a row with `code` was removed
+        """
+        self._counts[code] -= 1
+        if self._counts[code] == 0:
+            value = self._dictionary.decode(np.array([code]))[0]
+            i = bisect.bisect_left(self.values, value)
+            self.values = self.values[:i] + self.values[i + 1:]
+
+    def search_prefix(self, prefix: str, limit: Optional[int] = None) -> list:
+        """
+        :param prefix: the beginning of the values (case sensitive)
+        :param limit: the max number of results, no limit if None
+        :return: the values that start with `prefix`, sorted
+        """
+        values = self.values
+        if not prefix:
+            return values[:limit]
+        start = bisect.bisect_left(values, prefix)
+        end = start
+        while end < len(values) and (limit is None or end - start < limit) and values[end].startswith(prefix):
+            end += 1
+        return values[start:end]
+
+
+class _AppendBuffer:
+    """
+    rows that were appended to the DB and not merged yet into the main df, kept in growable column arrays
+    """
+    def __init__(self):
+        self.clear()
+
+    def __len__(self) -> int:
+        return len(self._columns["Value"])
+
+    def clear(self):
+        dtypes = {col: np.int32 for col in _CODED_COLUMNS} | {col: "datetime64[ns]" for col in _TIME_COLUMNS}
+        self._columns = {col: _Column(np.empty(0, dtype=dtypes.get(col, object))) for col in _COLUMNS}
+
+    def append(self, row: tuple):
+        """
+        :param row: the values of the row, ordered as `_COLUMNS`, with codes for the `_CODED_COLUMNS`
+        """
+        for col, value in zip(_COLUMNS, row):
+            if col in _TIME_COLUMNS:
+                value = pd.Timestamp(value).to_datetime64()
+            self._columns[col].append(value)
+
+    def pop(self):
+        for column in self._columns.values():
+            column.pop()
+
+    def take(self, offsets: np.ndarray, index: np.ndarray) -> pd.DataFrame:
+        """
+        :param offsets: the offsets of the rows in the buffer
+        :param index: the index labels for the rows
+        :return: df with the rows at `offsets`
+        """
+        return pd.DataFrame({col: column.values[offsets] for col, column in self._columns.items()}, index=index)
+
+    def views(self) -> dict[str, np.ndarray]:
+        """
+        :return: views on the columns by name
+        """
+        return {col: column.values for col, column in self._columns.items()}
+
+
+def _combine_codes(codes: list, sizes: list[int]):
+    """
+    :param codes: the codes of every column of a key (ints or arrays)
+    :param sizes: the sizes of the dictionaries of the columns
+    :return: a single int64 code for the key
+    """
+    combined = np.zeros_like(codes[0], dtype=np.int64)
+    for column_codes, size in zip(codes, sizes):
+        combined = combined * size + column_codes
+    return combined
+
+
+def _resolve(positions: np.ndarray, valid: np.ndarray, trans: np.ndarray, nulls: np.ndarray) -> np.ndarray:
+    """
+    the latest version of every valid start time group without null values, with one sort and reductions over the
+    groups instead of a groupby
+    :param positions: the positions of the rows
+    :param valid: the valid start times of the rows (ns since the epoch)
+    :param trans: the transaction times of the rows (ns since the epoch)
+    :param nulls: True for the rows with null value
+    :return: the indices (into the arrays) of the latest row of every group, the first position on ties,
+             sorted by the valid start time
+    """
+    if len(positions) == 0:
+        return np.empty(0, dtype=np.int64)
+    # the last row of every group is the latest one
+    order = np.lexsort((-positions, trans, valid))
+    sorted_valid = valid[order]
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = sorted_valid[1:] != sorted_valid[:-1]
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], len(order)) - 1
+    has_null = np.logical_or.reduceat(nulls[order], group_starts)
+    return order[group_ends[~has_null]]
+
+
+class _Blocks:
+    """
+    base of the structures that keep sorted arrays for every key (the codes of First name, Last name, LOINC-NUM)
+
+    the blocks of the rows the structure was built with are slices of flat arrays sorted by key, a block that is changed
+    later is replaced in `_blocks`. a change returns a new structure, that shares the flat arrays and the blocks that
+    didn't change, and leaves this one as is, so a reader can keep using it while the writer changes the db
+
+    `_blocks` is a two level hash trie of `_FANOUT` ** 2 dicts, a change copies only the path to the dict of its key (two
+    tuples of `_FANOUT` and one small dict), so its cost doesn't grow with the number of changed keys
+    """
+    def _build(self, sizes: list[int], sorted_keys: np.ndarray, arrays: tuple[np.ndarray, ...]):
+        """
+        :param sizes: the sizes of the dictionaries of the columns of `_KEY_COLUMNS`
+        :param sorted_keys: the combined codes (see `_combine_codes`) of the keys of the rows of `arrays`, sorted
+        :param arrays: the flat arrays, sorted like `sorted_keys`
+        """
+        self._sizes = sizes
+        self._arrays = arrays
+        self._blocks: tuple = (None,) * _FANOUT
+
+        new_key = np.ones(len(sorted_keys), dtype=bool)
+        new_key[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        self._starts = np.flatnonzero(new_key)
+        self._ends = np.append(self._starts[1:], len(sorted_keys))
+        self._keys = sorted_keys[self._starts]
+
+    def _block(self, key: tuple) -> tuple[np.ndarray, ...]:
+        """
+        :return: the slices of the arrays for `key`
+        """
+        i, j = self._slot(key)
+        inner = self._blocks[i]
+        leaf = inner[j] if inner is not None else None
+        block = leaf.get(key) if leaf is not None else None
+        if block is not None:
+            return block
+
+        # codes that were added after the structure was built are only in `_blocks`
+        if all(code < size for code, size in zip(key, self._sizes)):
+            combined = _combine_codes(list(key), self._sizes)
+            i = np.searchsorted(self._keys, combined)
+            if i < len(self._keys) and self._keys[i] == combined:
+                start, end = self._starts[i], self._ends[i]
+                return tuple(array[start:end] for array in self._arrays)
+        return tuple(array[:0] for array in self._arrays)
+
+    def _replace(self, key: tuple, block: tuple[np.ndarray, ...]):
+        """
+        :return: a copy of the structure with `block` for `key`
+        """
+        i, j = self._slot(key)
+        inner = self._blocks[i] or (None,) * _FANOUT
+        leaf = {**(inner[j] or {}), key: block}
+        changed = copy.copy(self)
+        changed._blocks = self._blocks[:i] + (inner[:j] + (leaf,) + inner[j + 1:],) + self._blocks[i + 1:]
+        return changed
+
+    @staticmethod
+    def _slot(key: tuple) -> tuple[int, int]:
+        """
+        :return: the position of the dict of `key` in `_blocks`, in the outer and the inner tuple
+        """
+        return divmod(hash(key) % (_FANOUT * _FANOUT), _FANOUT)
+
+
+class _KeyIndex(_Blocks):
+    """
+    index of the rows of the DB by the codes of (First name, Last name, LOINC-NUM)
+    every key points to a block of row positions sorted by the valid start time (in minutes)
+    """
+    def __init__(self, key_codes: list[np.ndarray], sizes: list[int], valid_minutes: np.ndarray,
+                 order: Optional[np.ndarray] = None):
+        """
+        :param key_codes: the codes of every column of `_KEY_COLUMNS`, the row positions are the positions in the codes
+        :param sizes: the sizes of the dictionaries of the columns of `_KEY_COLUMNS`
+        :param valid_minutes: the valid start times of the rows in minutes since the epoch
+        :param order: the result of `sort_order` for these rows, computed if None
+        """
+        order = self.sort_order(key_codes, sizes, valid_minutes) if order is None else order
+        self._build(sizes, _combine_codes(key_codes, sizes)[order], (valid_minutes[order], order))
+
+    @staticmethod
+    def sort_order(key_codes: list[np.ndarray], sizes: list[int], valid_minutes: np.ndarray) -> np.ndarray:
+        """
+        :return: the permutation that sorts the rows by key and then by valid start time
+        """
+        # lexsort is stable so equal rows stay in position order
+        return np.lexsort((valid_minutes, _combine_codes(key_codes, sizes)))
+
+    def add(self, key: tuple, valid_minute: int, position: int) -> "_KeyIndex":
+        """
+        :return: the index with the row added to the block of `key`, after the rows with the same valid start time
+        """
+        valid, positions = self._block(key)
+        i = np.searchsorted(valid, valid_minute, side="right")
+        return self._replace(key, (np.insert(valid, i, valid_minute), np.insert(positions, i, position)))
+
+    def remove(self, key: tuple, position: int) -> "_KeyIndex":
+        """
+        :return: the index without the row in the block of `key`
+        """
+        valid, positions = self._block(key)
+        keep = positions != position
+        return self._replace(key, (valid[keep], positions[keep]))
+
+    def block(self, key: tuple) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the valid start minutes and the positions of all the rows of `key`, sorted by valid start time
+        """
+        return self._block(key)
+
+    def lookup(self, key: tuple, start_minute: int, end_minute: int) -> np.ndarray:
+        """
+        :return: the positions of the rows of `key` with start_minute <= valid start minute <= end_minute,
+                 sorted by valid start time
+        """
+        valid, positions = self._block(key)
+        return positions[np.searchsorted(valid, start_minute, side="left"):np.searchsorted(valid, end_minute, side="right")]
+
+
+class _VersionEnds(_Blocks):
+    """
+    the transaction time range of every row version, in which it is the latest version of its
+    (First name, Last name, LOINC-NUM, valid start time) group: from its transaction minute up to (not including) the
+    transaction minute of the next version, so the versions of the db as of a transaction minute are the ones whose
+    range contains it (a stabbing query) instead of the latest of all the rows up to that minute. the versions without
+    end are the current state of the db
+    every key points to a block of its versions sorted by valid start time, then by transaction time and then by
+    descending position (like in `_resolve`)
+    """
+    def __init__(self, key_codes: list[np.ndarray], sizes: list[int], valid: np.ndarray, trans: np.ndarray,
+                 trans_minutes: np.ndarray, nulls: np.ndarray):
+        """
+        :param key_codes: the codes of every column of `_KEY_COLUMNS`, the row positions are the positions in the codes
+        :param sizes: the sizes of the dictionaries of the columns of `_KEY_COLUMNS`
+        :param valid: the valid start times of the rows (ns since the epoch)
+        :param trans: the transaction times of the rows (ns since the epoch)
+        :param trans_minutes: the transaction times of the rows in minutes since the epoch
+        :param nulls: True for the rows with null value
+        """
+        keys = _combine_codes(key_codes, sizes)
+        order = np.lexsort((-np.arange(len(keys)), trans, valid, keys))
+        keys, valid, nulls = keys[order], valid[order], nulls[order]
+        new_group = np.ones(len(order), dtype=bool)
+        new_group[1:] = (keys[1:] != keys[:-1]) | (valid[1:] != valid[:-1])
+
+        trans_minutes = trans_minutes[order]
+        ends = np.full(len(order), _NO_END, dtype=np.int64)
+        ends[:-1] = np.where(new_group[1:], _NO_END, trans_minutes[1:])
+        # whether the group had a null value up to every version
+        cumulative = np.cumsum(nulls)
+        group_start = np.maximum.accumulate(np.where(new_group, np.arange(len(order)), 0))
+        null_before = cumulative - cumulative[group_start] + nulls[group_start] > 0
+
+        self._build(sizes, keys, (valid, order, trans[order], trans_minutes, nulls, ends, null_before))
+
+    @staticmethod
+    def _regroup(block: tuple[np.ndarray, ...], valid: int) -> tuple[np.ndarray, ...]:
+        """
+        recompute (in place) the ranges of the versions of the `valid` group of a block
+        """
+        valid_times, _, _, trans_minutes, nulls, ends, null_before = block
+        start = np.searchsorted(valid_times, valid, side="left")
+        end = np.searchsorted(valid_times, valid, side="right")
+        ends[start:end] = np.append(trans_minutes[start + 1:end], _NO_END)
+        null_before[start:end] = np.logical_or.accumulate(nulls[start:end])
+        return block
+
+    def add(self, key: tuple, valid: int, trans: int, trans_minute: int, null: bool, position: int) -> "_VersionEnds":
+        """
+        :return: the structure with the new row version
+        """
+        block = self._block(key)
+        valid_times, _, trans_times = block[:3]
+        start = np.searchsorted(valid_times, valid, side="left")
+        end = np.searchsorted(valid_times, valid, side="right")
+        # the new row has the biggest position, so it is before the versions with the same transaction time
+        i = start + np.searchsorted(trans_times[start:end], trans, side="left")
+        block = tuple(np.insert(array, i, value)
+                      for array, value in zip(block, (valid, position, trans, trans_minute, null, _NO_END, False)))
+        return self._replace(key, self._regroup(block, valid))
+
+    def remove(self, key: tuple, position: int) -> "_VersionEnds":
+        """
+        :return: the structure without the row version
+        """
+        block = self._block(key)
+        i = np.flatnonzero(block[1] == position)[0]
+        valid = block[0][i]
+        block = tuple(np.delete(array, i) for array in block)
+        return self._replace(key, self._regroup(block, valid))
+
+    def lookup(self, key: tuple, start_minute: int, end_minute: int, minute: Optional[int]) -> np.ndarray:
+        """
+        :param minute: the transaction time of the query in minutes since the epoch, None for the current state
+        :return: the positions of the versions of `key` with start_minute <= valid start minute <= end_minute that were
+                 the latest version of their group as of `minute`, in a group without null values up to `minute`,
+                 sorted by valid start time
+        """
+        valid_times, positions, _, trans_minutes, _, ends, null_before = self._block(key)
+        start = np.searchsorted(valid_times, start_minute * _MINUTE_NS, side="left")
+        end = np.searchsorted(valid_times, (end_minute + 1) * _MINUTE_NS, side="left")
+        if minute is None:
+            live = ends[start:end] == _NO_END
+        else:
+            live = (trans_minutes[start:end] <= minute) & (ends[start:end] > minute)
+        return positions[start:end][live & ~null_before[start:end]]
+
+
+class _ResultCache:
+    """
+    LRU cache of the results of `MyDB.get_history`, by the normalized query (the codes of the key and the minute
+    bounds of the ranges), with a cap on the bytes of the results
+    a change of the rows of a key evicts only the results of that key. a reader that computed a result while the key
+    was changed doesn't cache it: the result is cached only if the generation of the key didn't change since the
+    reader got it (before it read the db)
+    """
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self._queries: dict[tuple, set[tuple]] = {}
+        self._generations: dict[tuple, int] = {}
+        self._epoch = 0
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def generation(self, key: tuple) -> tuple[int, int]:
+        """
+        :return: the generation of `key`, changed by every change of its rows
+        """
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def get(self, query: tuple) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(query)
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._entries.move_to_end(query)
+            return entry[0]
+
+    def put(self, query: tuple, generation: tuple[int, int], df: pd.DataFrame):
+        """
+        :param query: the normalized query, its key (codes) first
+        :param generation: the generation of the key when the result was computed
+        :param df: the result of the query
+        """
+        size = int(df.memory_usage(index=True).sum())
+        with self._lock:
+            if size > self._max_bytes or generation != (self._epoch, self._generations.get(query[0], 0)):
+                return
+            if query in self._entries:
+                return
+            self._entries[query] = (df, size)
+            self._queries.setdefault(query[0], set()).add(query)
+            self._bytes += size
+            while self._bytes > self._max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _drop(self, query: tuple):
+        _, size = self._entries.pop(query)
+        self._bytes -= size
+        queries = self._queries[query[0]]
+        queries.discard(query)
+        if not queries:
+            del self._queries[query[0]]
+
+    def invalidate(self, key: tuple):
+        """
+        the rows of `key` were changed
+        """
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            for query in self._queries.pop(key, ()):
+                _, size = self._entries.pop(query)
+                self._bytes -= size
+                self._invalidations += 1
+
+    def clear(self):
+        """
+        all the rows may have changed
+        """
+        with self._lock:
+            self._epoch += 1
+            self._invalidations += len(self._entries)
+            self._entries.clear()
+            self._queries.clear()
+            self._bytes = 0
+
+    def set_max_bytes(self, max_bytes: int):
+        with self._lock:
+            self._max_bytes = max_bytes
+            while self._bytes > self._max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else None,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self._max_bytes,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+
+class _Version:
+    """
+    an immutable state of the db for the readers, the writer publishes a new one after every change
+    the frame and the derived structures are never changed in place and the columns of the append buffer are read only
+    up to the length of the version, so a reader sees one consistent state without taking a lock
+    """
+    def __init__(self, frame: pd.DataFrame, appended: dict[str, np.ndarray], valid_minutes: _SplitArray,
+                 trans_minutes: _SplitArray, index: _KeyIndex, ends: Optional[_VersionEnds]):
+        self.frame = frame
+        self.appended = appended
+        self.valid_minutes = valid_minutes
+        self.trans_minutes = trans_minutes
+        self.index = index
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.valid_minutes)
+
+    def take(self, positions: np.ndarray) -> pd.DataFrame:
+        """
+        :param positions: the positions of the rows in the DB
+        :return: df with the rows at `positions` (from the main df and from the append buffer) in the same order, with
+                 codes in the `_CODED_COLUMNS`
+        """
+        in_frame = positions < len(self.frame)
+        if in_frame.all():
+            return self.frame.iloc[positions]
+        offsets = positions[~in_frame] - len(self.frame)
+        appended = pd.DataFrame({col: values[offsets] for col, values in self.appended.items()},
+                                index=positions[~in_frame])
+        if not in_frame.any():
+            return appended
+        rows = pd.concat([self.frame.iloc[positions[in_frame]], appended])
+        return rows.iloc[np.argsort(np.concatenate([np.flatnonzero(in_frame), np.flatnonzero(~in_frame)]))]
+
+    def column(self, col: str, positions: np.ndarray) -> np.ndarray:
+        """
+        :param col: the column
+        :param positions: the positions of the rows in the DB
+        :return: the values of the column at `positions`, without building a df
+        """
+        values = self.frame[col].values
+        in_frame = positions < len(values)
+        if in_frame.all():
+            return values[positions]
+        result = np.empty(len(positions), dtype=values.dtype)
+        result[in_frame] = values[positions[in_frame]]
+        result[~in_frame] = self.appended[col][positions[~in_frame] - len(values)]
+        return result
+
+    def find(self, col: str, code: int) -> np.ndarray:
+        """
+        :param col: one of the `_CODED_COLUMNS`
+        :param code: the code of a value of the column
+        :return: the positions of the rows with the value, sorted
+        """
+        return np.concatenate([np.flatnonzero(self.frame[col].values == code),
+                               np.flatnonzero(self.appended[col] == code) + len(self.frame)])
+
+
+def _read_xlsx(db_path: Path) -> tuple[pd.DataFrame, dict[str, list]]:
+    """
+    :param db_path: path to the xlsx for the db
+    :return: the df of the db with codes in the `_CODED_COLUMNS`, and the dictionaries of the codes
+    """
+    df = pd.read_excel(db_path)
+    df = df.loc[:, ~df.columns.str.startswith("Unnamed")]
+    df["Valid start time"] = pd.to_datetime(df["Valid start time"])
+    df["Transaction time"] = pd.to_datetime(df["Transaction time"])
+
+    dictionaries = {}
+    for col in _CODED_COLUMNS:
+        df[col], dictionaries[col] = snapshot.encode_strings(df[col].values)
+    return df[_COLUMNS], dictionaries
+
+
+def _coerce_value(value):
+    """
+    :return: `value` as one of the types of the "Value" column (None, int, float or str)
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return str(value)
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return float(value)
+    return str(value)
+
+
+def _read_feed(path: Path) -> pd.DataFrame:
+    """
+    read a workbook (xlsx) or a csv of lab results, runs in the worker processes of `MyDB.ingest`
+    :param path: the path of the file
+    :return: df with the `_COLUMNS`, the times as datetime64 and the values coerced (see `_coerce_value`)
+    :raise ValueError: if a column is missing or has bad values
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        df = pd.read_csv(path, dtype={col: str for col in _CODED_COLUMNS})
+    else:
+        df = pd.read_excel(path, dtype={col: str for col in _CODED_COLUMNS})
+
+    missing = [col for col in _COLUMNS if col not in df.columns]
+    if missing:
+        raise ValueError(f"{path} is missing the columns {missing}")
+    df = df[_COLUMNS].copy()
+    for col in _KEY_COLUMNS + _TIME_COLUMNS:
+        if df[col].isna().any():
+            raise ValueError(f"{path} has rows without {col}")
+    for col in _TIME_COLUMNS:
+        try:
+            df[col] = pd.to_datetime(df[col]).astype("datetime64[ns]")
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"{path} has a bad {col}: {e}")
+    values = np.empty(len(df), dtype=object)
+    values[:] = [_coerce_value(value) for value in df["Value"].values]
+    df["Value"] = values
+    return df
+
+
+def _read_snapshot(path: Path) -> tuple[pd.DataFrame, dict[str, list], np.ndarray, dict]:
+    """
+    :param path: the path of the snapshot
+    :return: the df of the db with codes in the `_CODED_COLUMNS`, the dictionaries of the codes,
+             the sort order of the index and the meta data of the snapshot
+    """
+    arrays, meta = snapshot.load(path)
+    dictionaries = meta["dictionaries"]
+
+    columns = {}
+    for col in _COLUMNS:
+        if col in _CODED_COLUMNS:
+            columns[col] = arrays[f"{col}.codes"]
+        elif col == "Value":
+            values = {name: arrays[f"Value.{name}"] for name in ("kinds", "numbers", "integers", "strings")}
+            columns[col] = snapshot.decode_values(values, dictionaries[col])
+        else:
+            columns[col] = arrays[col]
+
+    # copy=False keeps the memory-mapped columns mapped, pandas would otherwise copy them into one block per dtype
+    return (pd.DataFrame(columns, copy=False), {col: dictionaries[col] for col in _CODED_COLUMNS}, arrays["index.order"],
+            meta)
+
+
+def _check_source(db_path: Path, snapshot_path: Path, log_path: Path):
+    """
+    the xlsx is read instead of the snapshot when it is newer than the snapshot. that is safe only if no change would
+    be lost: the log holds only the changes since the last checkpoint, so the changes that were folded into the
+    snapshot can't be replayed on the xlsx
+    :raise ValueError: if the snapshot or the log hold changes that were made on an older xlsx
+    """
+    meta = snapshot.load_meta(snapshot_path)
+    records = wal.read_records(log_path)
+    changed = meta is not None and meta.get("changed", meta.get("wal_lsn", 0) > 0)
+    if changed or (records and records[0]["lsn"] != 1):
+        raise ValueError(
+            f"{db_path} is newer than the changes in {snapshot_path} and {log_path}, that were made on an older "
+            f"version of it. remove them to start over from {db_path}, or touch {snapshot_path}/meta.json to keep the "
+            f"changes")
+
+
+def _write_snapshot(path: Path, df: pd.DataFrame, dictionaries: dict[str, list], meta: dict):
+    """
+    :param path: the path of the snapshot
+    :param df: the df of the db with codes in the `_CODED_COLUMNS`
+    :param dictionaries: the dictionaries of the codes
+    :param meta: json serializable data to save with the snapshot
+    """
+    arrays = {}
+    dictionaries = dict(dictionaries)
+    for col in _COLUMNS:
+        if col in _CODED_COLUMNS:
+            arrays[f"{col}.codes"] = df[col].values
+        elif col == "Value":
+            values, dictionaries[col] = snapshot.encode_values(df[col].values)
+            arrays.update({f"Value.{name}": array for name, array in values.items()})
+        else:
+            arrays[col] = df[col].values.astype("datetime64[ns]")
+    arrays["index.order"] = _KeyIndex.sort_order(
+        [df[col].values for col in _KEY_COLUMNS],
+        [len(dictionaries[col]) for col in _KEY_COLUMNS],
+        _to_minutes(df["Valid start time"])
+    )
+    snapshot.save(path, arrays, {"dictionaries": dictionaries, **meta})
+
+
 class MyDB:
     """
     MyDB class for my management of the DB
     """
-    def __init__(self, db_path: Path, loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv")):
+    def __init__(self, db_path: Path, loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv"), persistent: bool = True):
         """
         :param db_path: path to the xlsx for the db
         :param loinc_code_db_path: the path to the csv of the loinc code
+        :param persistent: keep the db in a binary snapshot and a write-ahead log beside the xlsx, so the changes are
+                           durable. the snapshot is loaded instead of the xlsx when it is newer than the xlsx, and the
+                           log is replayed on top of it
+        :raise ValueError: if the xlsx is newer than the snapshot and the snapshot or the log hold changes (see
+                           `_check_source`)
         """
-        self.df = pd.read_excel(db_path)
-        self.df = self.df.loc[:, ~self.df.columns.str.startswith("Unnamed")]
-        self.df["Valid start time"] = pd.to_datetime(self.df["Valid start time"])
-        self.df["Transaction time"] = pd.to_datetime(self.df["Transaction time"])
+        meta = {}
+        snapshot_path = snapshot.snapshot_path(db_path)
+        if persistent:
+            snapshot.recover(snapshot_path)
+        if persistent and snapshot.is_fresh(snapshot_path, db_path):
+            df, dictionaries, index_order, meta = _read_snapshot(snapshot_path)
+            self._setup(df, dictionaries, index_order, loinc_code_db_path, meta)
+        else:
+            if persistent:
+                _check_source(db_path, snapshot_path, wal.log_path(db_path))
+            df, dictionaries = _read_xlsx(db_path)
+            self._setup(df, dictionaries, None, loinc_code_db_path, meta)
+            if persistent:
+                try:
+                    self.save_snapshot(snapshot_path)
+                except (OSError, TypeError):
+                    pass  # the snapshot is only a cache of the xlsx, the db works without it
 
-        self.loinc_df = pd.read_csv(loinc_code_db_path,  usecols=['LOINC_NUM', 'LONG_COMMON_NAME'])
+        if persistent:
+            self._open_wal(snapshot_path, wal.log_path(db_path), meta)
 
-        self.lastAdded = False
-        self.lastUndo = None
+    @classmethod
+    def from_snapshot(cls, path: Path, loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv"),
+                      persistent: bool = False) -> "MyDB":
+        """
+        :param path: the path of a snapshot written by `save_snapshot`
+        :param loinc_code_db_path: the path to the csv of the loinc code
+        :param persistent: keep the changes in a write-ahead log beside the snapshot (replayed on top of it), the
+                           checkpoints rewrite the snapshot
+        :return: the db of the snapshot
+        """
+        path = Path(path)
+        snapshot.recover(path)
+        df, dictionaries, index_order, meta = _read_snapshot(path)
+        db = cls.__new__(cls)
+        db._setup(df, dictionaries, index_order, loinc_code_db_path, meta)
+        if persistent:
+            db._open_wal(path, wal.log_path(path), meta)
+        return db
+
+    def _open_wal(self, snapshot_path: Path, log_path: Path, meta: dict):
+        """
+        make the db persistent, open its write-ahead log and replay the records after the snapshot
+        :param snapshot_path: the path of the snapshot the checkpoints write
+        :param log_path: the path of the write-ahead log
+        :param meta: the meta data of the snapshot the db was loaded from
+        """
+        self._snapshot_path = snapshot_path
+        self._wal = wal.WriteAheadLog(log_path, min_lsn=meta.get("wal_lsn", 0))
+        for record in self._wal.records(after_lsn=meta.get("wal_lsn", 0)):
+            self._replay(record)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv")) -> "MyDB":
+        """
+        :param df: the rows of the db, with the columns of the xlsx ("First name", "Last name", "LOINC-NUM", "Value",
+                   "Unit", "Valid start time", "Transaction time")
+        :param loinc_code_db_path: the path to the csv of the loinc code
+        :return: the db of the rows, not persistent
+        """
+        df = df[_COLUMNS].reset_index(drop=True)
+        df = df.assign(**{col: pd.to_datetime(df[col]) for col in _TIME_COLUMNS})
+        dictionaries = {}
+        for col in _CODED_COLUMNS:
+            codes, dictionaries[col] = snapshot.encode_strings(df[col].values)
+            df[col] = codes
+        db = cls.__new__(cls)
+        db._setup(df, dictionaries, None, loinc_code_db_path, {})
+        return db
+
+    def save_snapshot(self, path: Path):
+        """
+        write a binary columnar snapshot of the db, that can be loaded with `from_snapshot`
+        :param path: the path of the snapshot (a directory)
+        """
+        with self._lock:
+            df, dictionaries, meta = self._capture()
+        _write_snapshot(path, df, dictionaries, meta)
+
+    def checkpoint(self):
+        """
+        fold the write-ahead log into a new snapshot of the db
+        """
+        if self._wal is None:
+            raise ValueError("the db is not persistent")
+        with self._checkpoint_lock:
+            with self._lock:
+                df, dictionaries, meta = self._capture()
+            _write_snapshot(self._snapshot_path, df, dictionaries, meta)
+            self._wal.truncate(meta["wal_lsn"])
+
+    def ingest(self, paths: Iterable[Path], workers: Optional[int] = None) -> int:
+        """
+        add the rows of many workbooks (xlsx) / csv files at once, the files are parsed in parallel processes and
+        their rows are appended in one step (in the order of `paths`, like `add_row` of every row) with one rebuild
+        of the index
+        the ingested rows can't be undone, if the db is persistent they are written to a new snapshot before return
+        :param paths: the files, with the columns "First name", "Last name", "LOINC-NUM", "Value", "Unit",
+                      "Valid start time" and "Transaction time"
+        :param workers: the number of processes that parse the files, one per cpu if None, 1 to parse in this process
+        :return: the number of rows that were added
+        :raise ValueError: if a file is missing a column or has bad values, nothing is added
+        """
+        paths = list(paths)
+        if workers == 1 or len(paths) <= 1:
+            frames = [_read_feed(path) for path in paths]
+        else:
+            with ProcessPoolExecutor(workers) as pool:
+                frames = list(pool.map(_read_feed, paths))
+        if len(frames) == 0:
+            return 0
+        rows = pd.concat(frames, ignore_index=True)
+
+        with self._checkpoint_lock:
+            with self._lock:
+                self._merge()
+                for col in _CODED_COLUMNS:
+                    rows[col] = self._dictionaries[col].encode_all(rows[col].values)
+                self._frame = pd.concat([self._frame, rows], ignore_index=True)
+                self._decoded = None
+
+                self._valid_minutes.merge(_to_minutes(rows["Valid start time"]))
+                self._trans_minutes.merge(_to_minutes(rows["Transaction time"]))
+                self._index = _KeyIndex([self._frame[col].values for col in _KEY_COLUMNS],
+                                        [len(self._dictionaries[col]) for col in _KEY_COLUMNS],
+                                        self._valid_minutes.view().values)
+                self._ends = None
+                self._distinct = {col: _DistinctValues(self._dictionaries[col], self._frame[col].values)
+                                  for col in _KEY_COLUMNS}
+                self._undo_floor = self._size()
+                self._changed = True
+                self._undo_sizes.clear()
+                self._redo_entries.clear()
+                self._publish()
+                self._cache.clear()
+                if self._wal is not None:
+                    df, dictionaries, meta = self._capture()
+
+            if self._wal is not None:
+                _write_snapshot(self._snapshot_path, df, dictionaries, meta)
+                self._wal.truncate(meta["wal_lsn"])
+        return len(rows)
+
+    def close(self):
+        """
+        wait for a running checkpoint and close the write-ahead log
+        """
+        if self._checkpointer is not None:
+            self._checkpointer.join()
+        if self._wal is not None:
+            self._wal.close()
+            self._wal = None
+
+    def _capture(self) -> tuple[pd.DataFrame, dict[str, list], dict]:
+        """
+        must be called with `_lock`, doesn't change the db so the readers are not affected
+        :return: the df of the db (with codes in the `_CODED_COLUMNS`), the dictionaries of the codes and the meta data
+                 of its snapshot
+        """
+        df = self._frame
+        if len(self._appended) > 0:
+            appended = self._appended.take(np.arange(len(self._appended)), np.arange(len(self._frame), self._size()))
+            df = pd.concat([df, appended], ignore_index=True)
+
+        meta = {
+            "wal_lsn": 0 if self._wal is None else self._wal.lsn,
+            # the snapshot holds more than the rows of the xlsx
+            "changed": self._changed or (self._wal is not None and self._wal.lsn > 0),
+            "undo": {
+                "floor": self._undo_floor,
+                # a copy, the snapshot is written after `_lock` is released and the writers go on changing the list
+                "sizes": list(self._undo_sizes),
+                "redo": [[_encode_row(row) for row in entry] for entry in self._redo_entries],
+            }
+        }
+        return df, {col: dictionary.values for col, dictionary in self._dictionaries.items()}, meta
+
+    def _setup(self, df: pd.DataFrame, dictionaries: dict[str, list], index_order: Optional[np.ndarray],
+               loinc_code_db_path: Path, meta: dict):
+        """
+        :param df: the df of the db, with codes in the `_CODED_COLUMNS`
+        :param dictionaries: the dictionaries of the codes of the `_CODED_COLUMNS`
+        :param index_order: the sort order of the index (see `_KeyIndex.sort_order`), computed if None
+        :param loinc_code_db_path: the path to the csv of the loinc code
+        :param meta: the meta data of the snapshot of `df`
+        """
+        # the string columns are kept as codes, shared by `_frame` and `_appended`, and decoded only for the output
+        self._dictionaries = {col: _Dictionary(dictionaries[col]) for col in _CODED_COLUMNS}
+
+        # new rows are appended to `_appended` and merged into `_frame` only when the whole df is needed
+        self._frame = df
+        self._appended = _AppendBuffer()
+        # the decoded `_frame`, dropped on every change
+        self._decoded: Optional[pd.DataFrame] = None
+        # the transaction time range of every version, built on the first query without transaction start time
+        self._ends: Optional[_VersionEnds] = None
+
+        # the valid start / transaction times truncated to the minute, as minutes since the epoch
+        self._valid_minutes = _SplitColumn(_to_minutes(df["Valid start time"]))
+        self._trans_minutes = _SplitColumn(_to_minutes(df["Transaction time"]))
+        self._index = _KeyIndex([df[col].values for col in _KEY_COLUMNS],
+                                [len(self._dictionaries[col]) for col in _KEY_COLUMNS],
+                                self._valid_minutes.view().values, index_order)
+        # the sorted distinct values of the key columns, for autocomplete
+        self._distinct = {col: _DistinctValues(self._dictionaries[col], df[col].values) for col in _KEY_COLUMNS}
+        self._cache = _ResultCache(_CACHE_BYTES)
+
+        self.loinc_catalog = LoincCatalog.from_csv(loinc_code_db_path)
+
+        # the db has more than the rows of its xlsx (changes that were folded into its snapshot, or ingested rows)
+        self._changed: bool = meta.get("changed", meta.get("wal_lsn", 0) > 0)
+
+        # the undo journal: the rows after `_undo_floor` were added and can be undone (from the end) an entry at a time,
+        # `_undo_sizes` has the number of rows of every entry (a row of `add_row` or the rows of an `add_rows`). the
+        # undone entries are kept in `_redo_entries` (the last undone entry at the end) until a new row is added
+        undo = meta.get("undo", {})
+        self._undo_floor: int = undo.get("floor", len(df))
+        self._undo_sizes: list[int] = undo.get("sizes", [1] * (len(df) - self._undo_floor))
+        # older snapshots have a row (not a list of rows) for every undone entry
+        self._redo_entries: list[list[tuple]] = [
+            [_decode_row(row) for row in entry] if entry and isinstance(entry[0], list) else [_decode_row(entry)]
+            for entry in undo.get("redo", [])
+        ]
+
+        # the writers hold `_lock`, the changes are logged to `_wal` (if persistent) while holding it. the readers
+        # don't take it, they use `_version` (see `_Version`)
+        self._lock = threading.RLock()
+        self._checkpoint_lock = threading.Lock()
+        self._checkpointer: Optional[threading.Thread] = None
+        # the size of the log that starts a checkpoint, and the error of the last checkpoint in the background (if it
+        # failed)
+        self._checkpoint_at = _CHECKPOINT_RECORDS
+        self.checkpoint_error: Optional[Exception] = None
+        self._snapshot_path: Optional[Path] = None
+        self._wal: Optional[wal.WriteAheadLog] = None
+        self._publish()
+
+    def __len__(self) -> int:
+        return len(self._version)
+
+    def memory_usage(self) -> int:
+        """
+        :return: the approximate number of bytes of the columns of the db (without the strings of the values and the
+                 dictionaries)
+        """
+        version = self._version
+        return (int(version.frame.memory_usage(index=False).sum()) + sum(v.nbytes for v in version.appended.values())
+                + version.valid_minutes.nbytes + version.trans_minutes.nbytes)
+
+    def _size(self) -> int:
+        """
+        must be called with `_lock`
+        :return: the number of rows in the db, including a change that is not published yet
+        """
+        return len(self._frame) + len(self._appended)
+
+    def _publish(self):
+        """
+        must be called with `_lock`, after a change, make the current state visible to the readers
+        """
+        self._version = _Version(self._frame, self._appended.views(), self._valid_minutes.view(),
+                                 self._trans_minutes.view(), self._index, self._ends)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """
+        the whole DB, the rows in the append buffer are merged into it on access
+        """
+        with self._lock:
+            self._merge()
+            if self._decoded is None:
+                self._decoded = self._decode(self._frame)
+            return self._decoded
 
+    def _merge(self):
+        """
+        must be called with `_lock`, merge the rows in the append buffer into `_frame`
+        """
+        if len(self._appended) > 0:
+            appended = self._appended.take(np.arange(len(self._appended)), np.arange(len(self._frame), self._size()))
+            self._frame = pd.concat([self._frame, appended], ignore_index=True)
+            self._appended.clear()
+            self._valid_minutes.merge()
+            self._trans_minutes.merge()
+            self._decoded = None
+            self._publish()
+
+    def _ends_version(self) -> _Version:
+        """
+        :return: the current version of the db, with the transaction time ranges of the versions (built on the first
+                 call)
+        """
+        version = self._version
+        if version.ends is None:
+            with self._lock:
+                if self._ends is None:
+                    self._merge()
+                    self._ends = _VersionEnds(
+                        [self._frame[col].values for col in _KEY_COLUMNS],
+                        [len(self._dictionaries[col]) for col in _KEY_COLUMNS],
+                        self._frame["Valid start time"].values.view(np.int64),
+                        self._frame["Transaction time"].values.view(np.int64),
+                        self._trans_minutes.view().values,
+                        self._frame["Value"].isna().values
+                    )
+                    self._publish()
+                version = self._version
+        return version
+
+    def _decode(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        :param df: rows of the db with codes in the `_CODED_COLUMNS`
+        :return: the rows with the strings in the `_CODED_COLUMNS`
+        """
+        return df.assign(**{col: self._dictionaries[col].decode(df[col].values) for col in _CODED_COLUMNS})
+
+    def _encode(self, row: tuple) -> tuple:
+        """
+        :param row: the values of a row, ordered as `_COLUMNS`
+        :return: the row with codes in the `_CODED_COLUMNS`, new strings are added to the dictionaries
+        """
+        return tuple(
+            self._dictionaries[col].encode(value) if col in _CODED_COLUMNS else value
+            for col, value in zip(_COLUMNS, row)
+        )
+
+    def _key(self, first_name: str, last_name: str, loinc_code: str) -> Optional[tuple]:
+        """
+        :return: the codes of the key, None if one of its values is not in the db
+        """
+        key = tuple(self._dictionaries[col].code(value)
+                    for col, value in zip(_KEY_COLUMNS, (first_name, last_name, loinc_code)))
+        return None if None in key else key
+
+    def _rows(self, positions: np.ndarray, version: Optional[_Version] = None) -> pd.DataFrame:
+        """
+        :param positions: the positions of the rows in the DB
+        :param version: the version of the db to read, the current one if None
+        :return: df with the rows at `positions`
+        """
+        return self._decode((version or self._version).take(positions))
+
+    @tracing.traced("db.redo")
     def redo(self):
-        if self.lastUndo is None:
+        """
+        add back the last undone change (a row of `add_row` or all the rows of an `add_rows`), can be repeated until
+        there are no undone changes (a new row clears them)
+        :return: True if a change was added back
+        """
+        with self._lock:
+            done = self._redo()
+            lsn = self._log({"op": "redo"}) if done else None
+        self._commit(lsn)
+        return done
+
+    @tracing.traced("db.undo")
+    def undo(self):
+        """
+        remove the last added row (or all the rows of the last `add_rows`), can be repeated until all the rows that
+        were added to the db are removed
+        :return: True if a change was removed
+        """
+        with self._lock:
+            done = self._undo()
+            lsn = self._log({"op": "undo"}) if done else None
+        self._commit(lsn)
+        return done
+
+    @tracing.traced("db.add_row")
+    def add_row(self, first_name: str, last_name: str, loinc_code: str, valid_start_time: datetime.datetime, transaction_time: datetime.datetime, value: Optional[str], unit: str):
+        _check_value(value)
+        row = (first_name, last_name, loinc_code, value, unit, valid_start_time, transaction_time)
+        with self._lock:
+            position, = self._insert([row])
+            new_row = _row_series(row, position)
+            lsn = self._log({"op": "insert", "row": _encode_row(row)})
+        self._commit(lsn)
+        return new_row
+
+    @tracing.traced("db.add_rows")
+    def add_rows(self, rows: list[tuple]) -> pd.DataFrame:
+        """
+        add many rows at once, with one record in the write-ahead log, the readers see all of them or none of them
+        and they are undone (and redone) together
+        :param rows: (first_name, last_name, loinc_code, valid_start_time, transaction_time, value, unit) of every
+                     row, like the arguments of `add_row`
+        :return: df with the new rows, with their positions as index
+        :raise TypeError: if a value is not None, int, float or str, nothing is added
+        """
+        rows = [(first_name, last_name, loinc_code, value, unit, valid_start_time, transaction_time)
+                for first_name, last_name, loinc_code, valid_start_time, transaction_time, value, unit in rows]
+        if len(rows) == 0:
+            return pd.DataFrame(columns=_COLUMNS)
+        for row in rows:
+            _check_value(row[3])
+        with self._lock:
+            positions = self._insert(rows)
+            lsn = self._log({"op": "insert_many", "rows": [_encode_row(row) for row in rows]})
+        self._commit(lsn)
+        return pd.DataFrame(rows, columns=_COLUMNS, index=positions)
+
+    def _insert(self, rows: list[tuple]) -> list[int]:
+        """
+        add new rows as one entry of the undo journal, the undone entries can't be redone after it
+        :param rows: the values of the rows, ordered as `_COLUMNS`
+        :return: the positions of the rows
+        """
+        positions = self._append_all(rows)
+        self._undo_sizes.append(len(rows))
+        self._redo_entries.clear()
+        return positions
+
+    def _redo(self) -> bool:
+        if len(self._redo_entries) == 0:
             return False
 
-        # Add the row back safely
-        self.df = pd.concat([self.df, pd.DataFrame([self.lastUndo])], ignore_index=True)
-        self.lastUndo = None
-        self.lastAdded = True
+        rows = self._redo_entries.pop()
+        self._append_all(rows)
+        self._undo_sizes.append(len(rows))
         return True
 
-    def undo(self):
-        if not self.lastAdded:
+    def _undo(self) -> bool:
+        if len(self._undo_sizes) == 0 or self._size() <= self._undo_floor:
+            # the rows up to the floor (of the xlsx or ingested) are never undone, even if the journal says otherwise
+            self._undo_sizes.clear()
             return False
 
-        # Store last row for redo
-        self.lastUndo = self.df.iloc[-1].copy()
-        self.df = self.df.iloc[:-1].copy()
-        self.lastAdded = False
+        # Store the rows of the entry for redo
+        rows, keys = [], set()
+        for _ in range(min(self._undo_sizes.pop(), self._size() - self._undo_floor)):
+            row, key = self._pop()
+            rows.append(row)
+            keys.add(key)
+        self._redo_entries.append(rows[::-1])
+        self._publish()
+        for key in keys:
+            self._cache.invalidate(key)
         return True
 
-    def add_row(self, first_name: str, last_name: str, loinc_code: str, valid_start_time: datetime.datetime, transaction_time: datetime.datetime, value: Optional[str], unit: str):
-        self.df.loc[len(self.df)] = (first_name, last_name, loinc_code, value, unit, valid_start_time, transaction_time)
-        self.lastAdded = True
-        return self.df.iloc[-1]
+    def _pop(self) -> tuple[tuple, tuple]:
+        """
+        remove the last row, without publishing the change
+        :return: the values of the row (ordered as `_COLUMNS`) and its key (codes)
+        """
+        position = self._size() - 1
+        row = self._decode(self._appended.take(np.array([len(self._appended) - 1]), np.array([position]))
+                           if len(self._appended) > 0 else self._frame.iloc[[position]]).iloc[0]
+        key = self._key(*row[_KEY_COLUMNS])
+        self._index = self._index.remove(key, position)
+        if self._ends is not None:
+            self._ends = self._ends.remove(key, position)
+        for col, code in zip(_KEY_COLUMNS, key):
+            self._distinct[col].remove(code)
+        self._valid_minutes.pop()
+        self._trans_minutes.pop()
+        # the row is only cut off the end of the columns (a view), nothing is copied
+        if len(self._appended) > 0:
+            self._appended.pop()
+        else:
+            self._frame = self._frame.iloc[:-1]
+            if self._decoded is not None:
+                self._decoded = self._decoded.iloc[:-1]
+        return tuple(row[_COLUMNS]), key
+
+    def _replay(self, record: dict):
+        """
+        apply a record of the write-ahead log
+        """
+        if record["op"] == "insert":
+            self._insert([_decode_row(record["row"])])
+        elif record["op"] == "insert_many":
+            self._insert([_decode_row(row) for row in record["rows"]])
+        elif record["op"] == "undo":
+            self._undo()
+        elif record["op"] == "redo":
+            self._redo()
+        else:
+            raise ValueError(f"unknown write-ahead log record {record}")
+
+    def _log(self, record: dict) -> Optional[int]:
+        """
+        must be called with `_lock`, right after the change is applied
+        :return: the lsn of the record in the write-ahead log, None if the db is not persistent
+        """
+        if self._wal is None:
+            return None
+        return self._wal.append(record)
+
+    def _commit(self, lsn: Optional[int]):
+        """
+        wait (without `_lock`, so other writers can share the fsync) until the record `lsn` is durable,
+        and start a checkpoint in the background when the log is long
+        """
+        if lsn is None:
+            return
+        self._wal.wait(lsn)
+        if (self._wal.size >= self._checkpoint_at and
+                (self._checkpointer is None or not self._checkpointer.is_alive())):
+            self._checkpointer = threading.Thread(target=self._background_checkpoint, name="db-checkpoint",
+                                                  daemon=True)
+            self._checkpointer.start()
+
+    def _background_checkpoint(self):
+        """
+        `checkpoint` in the checkpoint thread, a failure is logged and kept in `checkpoint_error`, and the next try
+        waits for another `_CHECKPOINT_RECORDS` records
+        """
+        try:
+            self.checkpoint()
+        except Exception as e:
+            self.checkpoint_error = e
+            self._checkpoint_at = self._wal.size + _CHECKPOINT_RECORDS
+            _logger.exception("the checkpoint of %s failed, the write-ahead log keeps growing", self._snapshot_path)
+        else:
+            self.checkpoint_error = None
+            self._checkpoint_at = _CHECKPOINT_RECORDS
+
+    def _append_all(self, rows: list[tuple]) -> list[int]:
+        """
+        append rows to the append buffer, update the minute columns and the index, and publish them together
+        :param rows: the values of the rows, ordered as `_COLUMNS`
+        :return: the positions of the new rows
+        """
+        positions, keys = [], set()
+        for row in rows:
+            position, key = self._append(row)
+            positions.append(position)
+            keys.add(key)
+        self._publish()
+        for key in keys:
+            self._cache.invalidate(key)
+        return positions
 
+    def _append(self, row: tuple) -> tuple[int, tuple]:
+        """
+        append a row to the append buffer and update the minute columns and the index, without publishing the change
+        :param row: the values of the row, ordered as `_COLUMNS`
+        :return: the position of the new row and its key (codes)
+        """
+        position = self._size()
+        row = self._encode(row)
+        self._appended.append(row)
+        values = dict(zip(_COLUMNS, row))
+        valid_minute = _floor_minute(values["Valid start time"])
+        trans_minute = _floor_minute(values["Transaction time"])
+        self._valid_minutes.append(valid_minute)
+        self._trans_minutes.append(trans_minute)
+        key = tuple(values[col] for col in _KEY_COLUMNS)
+        self._index = self._index.add(key, valid_minute, position)
+        for col, code in zip(_KEY_COLUMNS, key):
+            self._distinct[col].add(code)
+        if self._ends is not None:
+            self._ends = self._ends.add(key, pd.Timestamp(values["Valid start time"]).value,
+                                        pd.Timestamp(values["Transaction time"]).value, trans_minute,
+                                        pd.isna(values["Value"]), position)
+        return position, key
+
+    @tracing.traced("db.get_history")
     def get_history(self, first_name: str, last_name: str, loinc_code: str, range_valid: tuple[datetime.datetime, datetime.datetime], range_trans: tuple[Optional[datetime.datetime], Optional[datetime.datetime]] = (None, None)):
         """
         :param first_name:
@@ -73,27 +1506,300 @@ class MyDB:
         :return:
         """
 
-        df: DataFrame = self.df[
-            (self.df["First name"] == first_name) &
-            (self.df["Last name"] == last_name) &
-            (self.df["LOINC-NUM"] == loinc_code) &
-            (self.df["Valid start time"].dt.floor('min') >= range_valid[0]) &
-            (self.df["Valid start time"].dt.floor('min') <= range_valid[1]) &
-            (range_trans[0] is None or self.df["Transaction time"].dt.floor('min') >= range_trans[0]) &
-            (range_trans[1] is None or self.df["Transaction time"].dt.floor('min') <= range_trans[1])
-        ]
+        key = self._key(first_name, last_name, loinc_code)
+        # floor(time) >= start  <=>  floor(time) >= ceil(start), floor(time) <= end  <=>  floor(time) <= floor(end)
+        start_minute, end_minute = _ceil_minute(range_valid[0]), _floor_minute(range_valid[1])
+        trans_start = None if range_trans[0] is None else _ceil_minute(range_trans[0])
+        trans_end = None if range_trans[1] is None else _floor_minute(range_trans[1])
+        if key is None:
+            return self._history(self._version, key, start_minute, end_minute, trans_start, trans_end)
 
-        good_groups = df.groupby("Valid start time")["Value"].apply(lambda s: s.notna().all())
-        df = df[df["Valid start time"].isin(good_groups[good_groups].index)]
-        df = df.loc[
-            df.groupby("Valid start time")["Transaction time"].idxmax()
-        ]
+        query = (key, start_minute, end_minute, trans_start, trans_end)
+        generation = self._cache.generation(key)
+        df = self._cache.get(query)
+        if df is None:
+            df = self._history(self._version, key, start_minute, end_minute, trans_start, trans_end)
+            self._cache.put(query, generation, df)
+        # the cached df is never handed out, the caller may change its copy
+        return df.copy()
+
+    def _history(self, version: _Version, key: Optional[tuple], start_minute: int, end_minute: int,
+                 trans_start: Optional[int], trans_end: Optional[int]) -> pd.DataFrame:
+        """
+        `get_history` on `version`, with the bounds in minutes since the epoch
+        """
+        if key is None:
+            positions = np.empty(0, dtype=np.int64)
+        elif trans_start is None:
+            # the db as of the end of the transaction time range (or now), the versions that were live then
+            with tracing.span("db.get_history.stab"):
+                version = self._ends_version()
+                positions = version.ends.lookup(key, start_minute, end_minute, trans_end)
+            with tracing.span("db.get_history.take"):
+                return self._rows(positions, version)
+        else:
+            with tracing.span("db.get_history.lookup"):
+                positions = version.index.lookup(key, start_minute, end_minute)
+        with tracing.span("db.get_history.mask"):
+            trans = version.trans_minutes[positions]
+            mask = np.ones(len(positions), dtype=bool)
+            if trans_start is not None:
+                mask &= trans >= trans_start
+            if trans_end is not None:
+                mask &= trans <= trans_end
+            positions = positions[mask]
+        with tracing.span("db.get_history.take"):
+            rows = version.take(positions)
+
+        with tracing.span("db.get_history.resolve"):
+            latest = _resolve(positions, rows["Valid start time"].values.view(np.int64),
+                              rows["Transaction time"].values.view(np.int64), rows["Value"].isna().values)
+        with tracing.span("db.get_history.decode"):
+            df: DataFrame = self._decode(rows.iloc[latest])
 
         return df
         # return df[["Value", "Unit", "Valid start time", "Transaction time"]]
 
+    def cache_stats(self) -> dict:
+        """
+        :return: the hits, misses, hit rate, entries, bytes, max bytes, evictions and invalidations of the result
+                 cache of `get_history`
+        """
+        return self._cache.stats()
+
+    def set_cache_size(self, max_bytes: int):
+        """
+        :param max_bytes: the max bytes of the results in the result cache of `get_history`, 0 disables the cache
+        """
+        self._cache.set_max_bytes(max_bytes)
+
+    def as_of_bulk(self, queries: pd.DataFrame) -> pd.DataFrame:
+        """
+        the result of many queries at once, the result of a query is the last row of `get_history` for it
+        :param queries: df with the columns "First name", "Last name", "LOINC-NUM", "Valid start time",
+                        "Valid end time" (optional, "Valid start time" if missing) and "Transaction time" (optional,
+                        the end of the transaction time range, NaT or missing for no bound)
+        :return: df with the columns of the db and the index of `queries`, the row of a query without result is
+                 all null
+        """
+        index = queries.index
+        queries = queries.reset_index(drop=True)
+        valid_start = queries["Valid start time"]
+        valid_end = queries["Valid end time"] if "Valid end time" in queries else valid_start
+        trans_end = queries["Transaction time"] if "Transaction time" in queries else pd.Series(pd.NaT, index=queries.index)
+
+        # the minute bounds of every query, see `get_history`
+        start_ns = pd.to_datetime(valid_start).values.astype("datetime64[ns]").view(np.int64)
+        start_minutes = -(-start_ns // _MINUTE_NS)
+        end_minutes = pd.to_datetime(valid_end).values.astype("datetime64[ns]").view(np.int64) // _MINUTE_NS
+        trans_end = pd.to_datetime(trans_end).values.astype("datetime64[ns]")
+        trans_minutes = np.where(np.isnat(trans_end), np.iinfo(np.int64).max,
+                                 trans_end.view(np.int64) // _MINUTE_NS)
+
+        version = self._version
+        codes = np.column_stack([self._dictionaries[col].codes(queries[col].values) for col in _KEY_COLUMNS])
+        known = np.flatnonzero((codes >= 0).all(axis=1))
+        keys, key_of_query = np.unique(codes[known], axis=0, return_inverse=True)
+
+        # the range of the rows of every query in the block of its key (sorted by valid start minute), by binary
+        # search of its valid bounds, so only the rows in the valid time range of a query are joined to it
+        key_of_query = key_of_query.reshape(-1)
+        by_key = np.argsort(key_of_query, kind="stable")
+        key_bounds = np.searchsorted(key_of_query[by_key], np.arange(len(keys) + 1))
+        blocks = []
+        lo = np.empty(len(known), dtype=np.int64)
+        hi = np.empty(len(known), dtype=np.int64)
+        offset = 0
+        for k, key in enumerate(keys):
+            valid, block = version.index.block(tuple(int(code) for code in key))
+            of_key = by_key[key_bounds[k]:key_bounds[k + 1]]
+            lo[of_key] = offset + np.searchsorted(valid, start_minutes[known[of_key]], side="left")
+            hi[of_key] = offset + np.searchsorted(valid, end_minutes[known[of_key]], side="right")
+            blocks.append(block)
+            offset += len(block)
+        candidates = np.concatenate(blocks) if blocks else np.empty(0, dtype=np.int64)
+
+        # the (query, position) pairs of the ranges
+        lengths = np.maximum(hi - lo, 0)
+        query = np.repeat(known, lengths)
+        positions = candidates[np.arange(lengths.sum()) + np.repeat(lo - (np.cumsum(lengths) - lengths), lengths)]
+        positions = positions.astype(np.int64)
+
+        keep = version.trans_minutes[positions] <= trans_minutes[query]
+        query, positions = query[keep], positions[keep]
+        rows = version.take(positions)
+
+        # drop the (query, valid start time) groups with a null value
+        groups = pd.DataFrame({
+            "query": query,
+            "valid": rows["Valid start time"].values.view(np.int64),
+            "null": rows["Value"].isna().values,
+        })
+        good = ~groups.groupby(["query", "valid"])["null"].transform("any").values
+        query, positions = query[good], positions[good]
+        valid = groups["valid"].values[good]
+        trans = rows["Transaction time"].values.view(np.int64)[good]
+
+        # the result of a query is the row with the latest valid start time, then the latest transaction time,
+        # then the first position
+        order = np.lexsort((-positions, trans, valid, query))
+        query, positions = query[order], positions[order]
+        last = np.ones(len(query), dtype=bool)
+        last[:-1] = query[1:] != query[:-1]
+        result = self._rows(positions[last], version)
+
+        result.index = query[last]
+        result = result.reindex(pd.RangeIndex(len(queries)))
+        result.index = index
+        return result
+
+    @tracing.traced("db.aggregate")
+    def aggregate(self, loinc_code: str, range_valid: tuple[datetime.datetime, datetime.datetime],
+                  bucket: Union[str, datetime.timedelta] = "1D", as_of: Optional[datetime.datetime] = None
+                  ) -> pd.DataFrame:
+        """
+        statistics of a test across all the patients, by valid time bucket
+        every measurement is taken as of `as_of` like in `get_history` (the latest version of every patient and valid
+        start time, the deleted ones are dropped), the values that are not numbers are not counted
+        :param loinc_code: the test
+        :param range_valid: the range of the valid start times of the measurements
+        :param bucket: the length of the buckets (like "1h" or "1D"), aligned to the epoch (so a day starts at midnight)
+        :param as_of: the transaction time of the db to read, the latest version of everything if None
+        :return: df with the columns "Bucket start", "Unit", "Count", "Mean", "Min" and "Max", a row for every bucket
+                 and unit with measurements, sorted by the bucket
+        """
+        bucket_ns = pd.Timedelta(bucket).value
+        if bucket_ns <= 0:
+            raise ValueError(f"the bucket must be positive, got {bucket!r}")
+        start_minute, end_minute = _ceil_minute(range_valid[0]), _floor_minute(range_valid[1])
+        trans_end = np.iinfo(np.int64).max if as_of is None else _floor_minute(as_of)
+
+        version = self._version
+        code = self._dictionaries["LOINC-NUM"].code(loinc_code)
+        with tracing.span("db.aggregate.scan"):
+            positions = np.empty(0, dtype=np.int64) if code is None else version.find("LOINC-NUM", code)
+            valid = version.valid_minutes[positions]
+            positions = positions[(valid >= start_minute) & (valid <= end_minute) &
+                                  (version.trans_minutes[positions] <= trans_end)]
+
+        with tracing.span("db.aggregate.resolve"):
+            # the latest version of every (patient, valid start time) group without null values, see `_resolve`
+            patient = _combine_codes([version.column(col, positions) for col in ["First name", "Last name"]],
+                                     [len(self._dictionaries[col]) for col in ["First name", "Last name"]])
+            valid = version.column("Valid start time", positions).view(np.int64)
+            trans = version.column("Transaction time", positions).view(np.int64)
+            order = np.lexsort((-positions, trans, valid, patient))
+            positions, patient, valid = positions[order], patient[order], valid[order]
+            new_group = np.ones(len(positions), dtype=bool)
+            new_group[1:] = (patient[1:] != patient[:-1]) | (valid[1:] != valid[:-1])
+            group_starts = np.flatnonzero(new_group)
+            if len(group_starts) > 0:
+                group_ends = np.append(group_starts[1:], len(positions)) - 1
+                values = version.column("Value", positions)
+                has_null = np.logical_or.reduceat(pd.isna(values), group_starts)
+                latest = group_ends[~has_null]
+                positions, valid = positions[latest], valid[latest]
+                values = pd.to_numeric(values[latest], errors="coerce").astype(np.float64)
+            else:
+                values = np.empty(0, dtype=np.float64)
+
+        with tracing.span("db.aggregate.bucket"):
+            numeric = ~np.isnan(values)
+            values = values[numeric]
+            if len(values) == 0:
+                return pd.DataFrame({
+                    "Bucket start": pd.Series(dtype="datetime64[ns]"), "Unit": pd.Series(dtype=object),
+                    "Count": pd.Series(dtype=np.int64), "Mean": pd.Series(dtype=np.float64),
+                    "Min": pd.Series(dtype=np.float64), "Max": pd.Series(dtype=np.float64),
+                })
+            buckets = valid[numeric] // bucket_ns
+            units = version.column("Unit", positions[numeric]).astype(np.int64)
+            groups = (buckets - buckets.min()) * len(self._dictionaries["Unit"]) + units
+            order = np.argsort(groups, kind="stable")
+            groups, values = groups[order], values[order]
+            new_group = np.ones(len(groups), dtype=bool)
+            new_group[1:] = groups[1:] != groups[:-1]
+            group_starts = np.flatnonzero(new_group)
+            counts = np.diff(np.append(group_starts, len(groups)))
+            firsts = order[group_starts]
+            return pd.DataFrame({
+                "Bucket start": (buckets[firsts] * bucket_ns).astype("datetime64[ns]"),
+                "Unit": self._dictionaries["Unit"].decode(units[firsts]),
+                "Count": counts,
+                "Mean": np.add.reduceat(values, group_starts) / counts,
+                "Min": np.minimum.reduceat(values, group_starts),
+                "Max": np.maximum.reduceat(values, group_starts),
+            })
+
+    def distinct_values(self, column: str) -> list:
+        """
+        :param column: "First name", "Last name" or "LOINC-NUM"
+        :return: the distinct values of the column in the db, sorted
+        """
+        return list(self._distinct_column(column).values)
+
+    def search_values(self, column: str, prefix: str, limit: Optional[int] = 20) -> list:
+        """
+        :param column: "First name", "Last name" or "LOINC-NUM"
+        :param prefix: the beginning of the values (case sensitive)
+        :param limit: the max number of results, no limit if None
+        :return: the distinct values of the column in the db that start with `prefix`, sorted
+        """
+        return self._distinct_column(column).search_prefix(prefix, limit)
+
+    def _distinct_column(self, column: str) -> _DistinctValues:
+        if column not in self._distinct:
+            raise ValueError(f"no distinct values for the column {column!r}, only for {_KEY_COLUMNS}")
+        return self._distinct[column]
+
     def get_name_by_loinc(self, loinc: str) -> Optional[str]:
-        df = self.loinc_df[self.loinc_df['LOINC_NUM'] == loinc]['LONG_COMMON_NAME']
-        if len(df) == 0:
-            return None
-        return df.iloc[0]
\ No newline at end of file
+        return self.loinc_catalog.name(loinc)
+
+# the dbs that are open in the process, by the resolved path of their xlsx and their partitions: [db, number of users]
+_open_dbs: dict[tuple[Path, Optional[int]], list] = {}
+_open_dbs_lock = threading.Lock()
+
+
+def open_db(db_path: Path, loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv"), persistent: bool = True,
+            partitions: Optional[int] = None) -> MyDB:
+    """
+    the shared db of `db_path`, every user of the db in the process (API, MyShell, ...) gets the same instance so the
+    xlsx and the loinc csv are loaded once
+    every call must be matched by a call to `release_db`
+    :param db_path: path to the xlsx for the db
+    :param loinc_code_db_path: the path to the csv of the loinc code, used only when the db is loaded
+    :param persistent: like in `MyDB`, used only when the db is loaded
+    :param partitions: keep the db partitioned by patient in this number of partitions (a `PartitionedDB`, see
+                       `PartitionedDB.open`), the environment variable MYDB_PARTITIONS if None, not partitioned if
+                       that is not set either
+    """
+    if partitions is None:
+        partitions = int(os.environ.get("MYDB_PARTITIONS", "0")) or None
+    key = (Path(db_path).resolve(), partitions)
+    with _open_dbs_lock:
+        entry = _open_dbs.get(key)
+        if entry is None:
+            if partitions is None:
+                db = MyDB(db_path, loinc_code_db_path, persistent)
+            else:
+                from partitions import PartitionedDB  # partitions imports this module
+                db = PartitionedDB.open(db_path, partitions, loinc_code_db_path=loinc_code_db_path,
+                                        persistent=persistent)
+            entry = _open_dbs[key] = [db, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release_db(db: MyDB):
+    """
+    a user of a db from `open_db` is done with it, the db is closed when its last user releases it
+    """
+    with _open_dbs_lock:
+        for key, entry in _open_dbs.items():
+            if entry[0] is db:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _open_dbs[key]
+                    db.close()
+                return
+    raise ValueError("the db was not opened with open_db")
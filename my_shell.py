@@ -1,9 +1,12 @@
 import cmd
+import csv
 import datetime
 import shlex
 from typing import Optional
 
-from myDB import MyDB
+import tracing
+from api import API
+from myDB import open_db, release_db
 from pathlib import Path
 import argparse
 
@@ -60,6 +63,88 @@ def _redo_arg_parser(args):
         print()
         return None
 
+def _stats_arg_parser(args):
+    args = shlex.split(args)
+    parser = argparse.ArgumentParser(prog="stats", description="show the latencies of the traced operations and the result cache")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--on", action="store_true", help="start tracing")
+    group.add_argument("--off", action="store_true", help="stop tracing")
+    parser.add_argument("--reset", action="store_true", help="drop the recorded latencies")
+    try:
+        return parser.parse_args(args)
+    except:
+        print()
+        return None
+
+def _profile_arg_parser(args):
+    args = shlex.split(args)
+    parser = argparse.ArgumentParser(prog="profile", description="profile the next commands")
+    parser.add_argument("action", choices=["start", "stop"])
+    parser.add_argument(
+        "path",
+        type=Path,
+        nargs="?",
+        default=Path("profile.folded"),
+        help="the output file (of start), collapsed stacks for flamegraph.pl / speedscope, or pstats with --cprofile"
+    )
+    parser.add_argument("--cprofile", action="store_true", help="use cProfile instead of sampling")
+    parser.add_argument("--interval", type=float, default=0.005, help="the seconds between samples")
+    try:
+        return parser.parse_args(args)
+    except:
+        print()
+        return None
+
+def _update_batch_arg_parser(args):
+    args = shlex.split(args)
+    parser = argparse.ArgumentParser(
+        prog="update_batch",
+        description="update (or delete) many test results at the current time, undone together by one undo"
+    )
+    parser.add_argument(
+        "path",
+        type=Path,
+        help="csv with the columns first_name, last_name, loinc, date (YYYY-MM-DD), time (HH:MM, may be empty) "
+             "and value (empty to delete)"
+    )
+    try:
+        return parser.parse_args(args)
+    except:
+        print()
+        return None
+
+def _aggregate_arg_parser(args):
+    args = shlex.split(args)
+    parser = argparse.ArgumentParser(
+        prog="aggregate",
+        description="count, mean, min and max of a test across all the patients, by valid time bucket"
+    )
+    parser.add_argument(
+        "loinc_code",
+        type=str,
+        help="test's loinc code"
+    )
+    parser.add_argument(
+        "start_date",
+        type=lambda s: datetime.datetime.strptime(s, "%Y-%m-%d").date(),
+        help="Date in YYYY-MM-DD format for the first valid date."
+    )
+    parser.add_argument(
+        "end_date",
+        type=lambda s: datetime.datetime.strptime(s, "%Y-%m-%d").date(),
+        help="Date in YYYY-MM-DD format for the last valid date."
+    )
+    parser.add_argument(
+        "--bucket", '-b',
+        default="1D",
+        help="the length of the buckets, like 1h, 6h or 1D (the default)"
+    )
+    try:
+        return parser.parse_args(args)
+    except:
+        print()
+        return None
+
 def _get_history_arg_parser(args):
     args = shlex.split(args)
     parser = argparse.ArgumentParser(prog="get_history",
@@ -269,7 +354,7 @@ class MyShell(cmd.Cmd):
 
     def __init__(self):
         super().__init__()
-        self.db = MyDB(Path("dbs/project_db_2025.xlsx"))
+        self.db = open_db(Path("dbs/project_db_2025.xlsx"))
         self.time: Optional[datetime.datetime] = None
 
     def do_undo(self, args):
@@ -444,9 +529,99 @@ class MyShell(cmd.Cmd):
             print(row)
             self.db.add_row(args.first_name, args.last_name, args.loinc_code, row['Valid start time'], self._get_time(), None, row["Unit"])
 
+    def do_aggregate(self, arg):
+        args = _aggregate_arg_parser(arg)
+        if args is None:
+            return
+
+        loinc_full_name = self.db.get_name_by_loinc(args.loinc_code)
+        if loinc_full_name is None:
+            print(f"loinc name cannot be found for code \"{args.loinc_code}\"")
+            return
+
+        try:
+            stats = self.db.aggregate(args.loinc_code,
+                                      (datetime.datetime.combine(args.start_date, datetime.time.min),
+                                       datetime.datetime.combine(args.end_date, datetime.time.max)),
+                                      bucket=args.bucket,
+                                      as_of=self.time)
+        except ValueError as e:
+            print(f"bad bucket \"{args.bucket}\": {e}")
+            return
+
+        print(f"the \"{loinc_full_name}\" test ({args.loinc_code}) results of all the patients from {args.start_date} "
+              f"to {args.end_date} by {args.bucket} at {self._get_time()}:")
+        print(stats.to_string(index=False))
+
+    def do_update_batch(self, arg):
+        args = _update_batch_arg_parser(arg)
+        if args is None:
+            return
+
+        # the rows are read from the current time (or the time machine), like `update`
+        trans_date = None if self.time is None else self.time.date()
+        trans_time = None if self.time is None else self.time.time()
+        updates = []
+        line = 1
+        try:
+            with open(args.path, newline="", encoding="utf-8") as f:
+                for line, row in enumerate(csv.DictReader(f), start=2):
+                    updates.append((
+                        row["first_name"], row["last_name"], row["loinc"],
+                        datetime.datetime.strptime(row["date"], "%Y-%m-%d").date(),
+                        datetime.datetime.strptime(row["time"], "%H:%M").time() if row.get("time") else None,
+                        trans_date, trans_time,
+                        row["value"] if row.get("value") else None
+                    ))
+        except OSError as e:
+            print(f"cannot read {args.path}: {e}")
+            return
+        except (KeyError, ValueError) as e:
+            print(f"bad line {line} in {args.path}: {e!r}")
+            return
+
+        result = API(self.db).update_many(updates)
+        print(f"{len(result['new'])} test results were changed at {self._get_time()}, `undo` reverts all of them")
+        for i in result["superseded"]:
+            print(f"line {i + 2} was skipped, a later line changes the same test result")
+        for i in result["missing"]:
+            first_name, last_name, loinc, date, time = updates[i][:5]
+            print(f"cannot find any test {loinc} for {first_name} {last_name} at {date}{'' if time is None else f' {time}'}"
+                  f" (line {i + 2})")
+
+    def do_stats(self, arg):
+        args = _stats_arg_parser(arg)
+        if args is None:
+            return
+        if args.on:
+            tracing.enable()
+        elif args.off:
+            tracing.disable()
+        print(tracing.format_stats())
+        cache = self.db.cache_stats()
+        print(f"\nresult cache: {cache['hits']} hits, {cache['misses']} misses, {cache['entries']} entries "
+              f"({cache['bytes']} of {cache['max_bytes']} bytes), {cache['evictions']} evictions, "
+              f"{cache['invalidations']} invalidations")
+        if args.reset:
+            tracing.reset()
+
+    def do_profile(self, arg):
+        args = _profile_arg_parser(arg)
+        if args is None:
+            return
+        try:
+            if args.action == "start":
+                tracing.start_profiling(args.path, sampling=not args.cprofile, interval=args.interval)
+                print(f"profiling to {args.path}, run `profile stop` to write it")
+            else:
+                print(f"the profile was written to {tracing.stop_profiling()}")
+        except RuntimeError as e:
+            print(e)
+
     def do_exit(self, arg) -> bool:
         """
         Exit the shell
         """
+        release_db(self.db)
         print("Goodbye!")
         return True
@@ -0,0 +1,400 @@
+"""
+the DB partitioned by patient, for cohorts with more history than fits in memory
+the rows of every patient are in one of a fixed number of partitions (by a hash of the first and last name), every
+partition is a snapshot on disk with its own write-ahead log. a partition is loaded (as a `MyDB`) on the first query
+of one of its patients, and the least recently used partitions are closed when the loaded partitions go over the
+memory budget
+"""
+import datetime
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+
+import snapshot
+import wal
+from loinc_catalog import LoincCatalog
+from myDB import (MyDB, _CODED_COLUMNS, _COLUMNS, _KEY_COLUMNS, _Dictionary, _DistinctValues, _decode_row,
+                  _read_xlsx, _write_snapshot)
+
+_META_FILE = "partitions.json"
+
+
+def partition_of(first_name: str, last_name: str, partitions: int) -> int:
+    """
+    :return: the partition of the rows of the patient, stable across processes
+    """
+    return zlib.crc32(f"{first_name}\x1f{last_name}".encode("utf-8")) % partitions
+
+
+def partitions_path(db_path: Path) -> Path:
+    """
+    :param db_path: path to the xlsx for the db
+    :return: the directory of the partitions of the db, beside the xlsx
+    """
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.stem + ".partitions")
+
+
+def _partition_path(directory: Path, partition: int) -> Path:
+    return directory / f"part-{partition:04d}.snapshot"
+
+
+class PartitionedDB:
+    """
+    the per-patient operations of `MyDB` on a db that is partitioned by patient
+    the positions of the rows (the index of `get_history`) are positions in the partition of the patient, and `undo` /
+    `redo` cover the rows that were added since the db was opened. can be used instead of a `MyDB` by `API` and
+    `MyShell` (see `open_db`)
+    """
+    def __init__(self, directory: Path, loinc_code_db_path: Path = Path("dbs/LoincTableCore.csv"),
+                 memory_budget: int = 1 << 30, persistent: bool = True):
+        """
+        :param directory: the directory of the partitions, written by `create`
+        :param loinc_code_db_path: the path to the csv of the loinc code
+        :param memory_budget: the max bytes of the loaded partitions (see `MyDB.memory_usage`), the partition of the
+                              last query is kept even if it is larger
+        :param persistent: keep the changes in the write-ahead logs of the partitions, otherwise the changes of a
+                           partition are lost when it is closed
+        """
+        self._directory = Path(directory)
+        with open(self._directory / _META_FILE, encoding="utf-8") as f:
+            self._partitions: int = json.load(f)["partitions"]
+        self.loinc_catalog = LoincCatalog.from_csv(loinc_code_db_path)
+        self._memory_budget = memory_budget
+        self._persistent = persistent
+
+        # the loaded partitions, the least recently used first, and their memory usage
+        self._loaded: OrderedDict[int, MyDB] = OrderedDict()
+        self._memory: dict[int, int] = {}
+        # the partitions of every change that can be undone (the last at the end) and of every undone change, a
+        # change of `add_rows` is an entry of every partition it added rows to
+        self._undo_partitions: list[list[int]] = []
+        self._redo_partitions: list[list[int]] = []
+        # the max bytes of the result cache of every partition, the default of `MyDB` if None
+        self._cache_size: Optional[int] = None
+        # the distinct values of the key columns in all the partitions and their dictionaries, built on the first
+        # search
+        self._distinct: Optional[dict[str, _DistinctValues]] = None
+        self._dictionaries: dict[str, _Dictionary] = {}
+        # the writers and the loading / closing of partitions hold `_lock`, so a partition is never closed during a
+        # write. the readers hold it only to get their partition
+        self._lock = threading.RLock()
+
+    @classmethod
+    def create(cls, directory: Path, db_path: Path, partitions: int = 64, **kwargs) -> "PartitionedDB":
+        """
+        partition the db of an xlsx, the partitions in `directory` (if any) are replaced
+        :param directory: the directory of the partitions
+        :param db_path: path to the xlsx for the db
+        :param partitions: the number of partitions
+        :param kwargs: the arguments of `PartitionedDB`
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        df, dictionaries = _read_xlsx(db_path)
+
+        # the partition of every distinct patient, then of every row
+        first_names, last_names = dictionaries["First name"], dictionaries["Last name"]
+        patients, patient_of_row = np.unique(
+            df["First name"].values.astype(np.int64) * len(last_names) + df["Last name"].values, return_inverse=True)
+        partition_of_patient = np.array(
+            [partition_of(first_names[patient // len(last_names)], last_names[patient % len(last_names)], partitions)
+             for patient in patients], dtype=np.int64)
+        partition_of_row = partition_of_patient[patient_of_row]
+
+        order = np.argsort(partition_of_row, kind="stable")
+        bounds = np.searchsorted(partition_of_row[order], np.arange(partitions + 1))
+        for partition in range(partitions):
+            rows = df.iloc[order[bounds[partition]:bounds[partition + 1]]].reset_index(drop=True)
+            # every partition has its own dictionaries, with only the strings of its rows
+            local_dictionaries = {}
+            for col in _CODED_COLUMNS:
+                codes, uniques = pd.factorize(rows[col].values)
+                rows[col] = codes.astype(np.int32)
+                local_dictionaries[col] = [dictionaries[col][code] for code in uniques]
+            path = _partition_path(directory, partition)
+            _write_snapshot(path, rows, local_dictionaries, {})
+            wal.log_path(path).unlink(missing_ok=True)
+
+        with open(directory / _META_FILE, "w", encoding="utf-8") as f:
+            json.dump({"partitions": partitions}, f)
+        return cls(directory, **kwargs)
+
+    @classmethod
+    def open(cls, db_path: Path, partitions: int = 64, **kwargs) -> "PartitionedDB":
+        """
+        the partitioned db of an xlsx, in the directory of `partitions_path` (created on the first open)
+        the partitions are not rebuilt when the xlsx changes, remove their directory to partition it again
+        :param db_path: path to the xlsx for the db
+        :param partitions: the number of partitions
+        :param kwargs: the arguments of `PartitionedDB`
+        :raise ValueError: if the db was partitioned to a different number of partitions
+        """
+        directory = partitions_path(db_path)
+        if not (directory / _META_FILE).exists():
+            return cls.create(directory, db_path, partitions, **kwargs)
+        db = cls(directory, **kwargs)
+        if db._partitions != partitions:
+            raise ValueError(f"{directory} has {db._partitions} partitions, not {partitions}")
+        return db
+
+    def _partition(self, partition: int) -> MyDB:
+        """
+        :return: the db of the partition, loaded if needed
+        """
+        with self._lock:
+            db = self._loaded.get(partition)
+            if db is not None:
+                self._loaded.move_to_end(partition)
+                return db
+
+            db = MyDB.from_snapshot(_partition_path(self._directory, partition), persistent=self._persistent)
+            db.loinc_catalog = self.loinc_catalog
+            if self._cache_size is not None:
+                db.set_cache_size(self._cache_size)
+            self._loaded[partition] = db
+            self._memory[partition] = db.memory_usage()
+            self._evict()
+            return db
+
+    def _evict(self):
+        """
+        must be called with `_lock`, close the least recently used partitions until the rest fit in the budget
+        """
+        while len(self._loaded) > 1 and sum(self._memory.values()) > self._memory_budget:
+            partition, db = self._loaded.popitem(last=False)
+            del self._memory[partition]
+            db.close()
+            if not self._persistent:
+                # the changes of the partition are gone, they can't be undone
+                self._undo_partitions = [[p for p in entry if p != partition] for entry in self._undo_partitions]
+                self._undo_partitions = [entry for entry in self._undo_partitions if entry]
+                self._redo_partitions = [[p for p in entry if p != partition] for entry in self._redo_partitions]
+                self._redo_partitions = [entry for entry in self._redo_partitions if entry]
+
+    def _patient(self, first_name: str, last_name: str) -> tuple[int, MyDB]:
+        partition = partition_of(first_name, last_name, self._partitions)
+        return partition, self._partition(partition)
+
+    def loaded_partitions(self) -> list[int]:
+        """
+        :return: the partitions that are loaded, the least recently used first
+        """
+        with self._lock:
+            return list(self._loaded)
+
+    def get_history(self, first_name: str, last_name: str, loinc_code: str,
+                    range_valid: tuple[datetime.datetime, datetime.datetime],
+                    range_trans: tuple[Optional[datetime.datetime], Optional[datetime.datetime]] = (None, None)
+                    ) -> pd.DataFrame:
+        """
+        like `MyDB.get_history`, reads only the partition of the patient
+        """
+        _, db = self._patient(first_name, last_name)
+        return db.get_history(first_name, last_name, loinc_code, range_valid, range_trans)
+
+    def as_of_bulk(self, queries: pd.DataFrame) -> pd.DataFrame:
+        """
+        like `MyDB.as_of_bulk`, the queries are answered by the partitions of their patients
+        """
+        index = queries.index
+        queries = queries.reset_index(drop=True)
+        partitions = np.array([partition_of(first_name, last_name, self._partitions)
+                               for first_name, last_name in zip(queries["First name"], queries["Last name"])],
+                              dtype=np.int64)
+        results = [self._partition(partition).as_of_bulk(queries[partitions == partition])
+                   for partition in np.unique(partitions)]
+        if len(results) == 0:
+            return pd.DataFrame(columns=_COLUMNS, index=index)
+        result = pd.concat(results).reindex(pd.RangeIndex(len(queries)))
+        result.index = index
+        return result
+
+    def add_row(self, first_name: str, last_name: str, loinc_code: str, valid_start_time: datetime.datetime,
+                transaction_time: datetime.datetime, value: Optional[str], unit: str) -> pd.Series:
+        """
+        like `MyDB.add_row`, the row is added to the partition of the patient
+        """
+        with self._lock:
+            partition, db = self._patient(first_name, last_name)
+            row = db.add_row(first_name, last_name, loinc_code, valid_start_time, transaction_time, value, unit)
+            self._added(partition, db, [(first_name, last_name, loinc_code)])
+            self._undo_partitions.append([partition])
+            self._redo_partitions.clear()
+            return row
+
+    def add_rows(self, rows: list[tuple]) -> pd.DataFrame:
+        """
+        like `MyDB.add_rows`, the rows of every patient are added to its partition and one `undo` removes all of them.
+        the readers of a partition see all its rows or none of them, but may see the rows of one partition before the
+        rows of another
+        :return: df with the new rows in the order of `rows`, with their positions in their partitions as index
+        """
+        if len(rows) == 0:
+            return pd.DataFrame(columns=_COLUMNS)
+        partitions = np.array([partition_of(row[0], row[1], self._partitions) for row in rows], dtype=np.int64)
+        with self._lock:
+            added, entry = [], []
+            for partition in np.unique(partitions).tolist():
+                of_partition = np.flatnonzero(partitions == partition)
+                db = self._partition(partition)
+                new = db.add_rows([rows[i] for i in of_partition])
+                added.append((of_partition, new))
+                entry.append(partition)
+                self._added(partition, db, [rows[i][:3] for i in of_partition])
+            self._undo_partitions.append(entry)
+            self._redo_partitions.clear()
+        order = np.argsort(np.concatenate([of_partition for of_partition, _ in added]), kind="stable")
+        return pd.concat([new for _, new in added]).iloc[order]
+
+    def _added(self, partition: int, db: MyDB, keys: list[tuple]):
+        """
+        must be called with `_lock`, after rows were added to the partition
+        :param keys: (first_name, last_name, loinc_code) of the rows
+        """
+        self._memory[partition] = db.memory_usage()
+        self._evict()
+        if self._distinct is not None:
+            for key in keys:
+                for col, value in zip(_KEY_COLUMNS, key):
+                    self._distinct[col].add(self._dictionaries[col].encode(value))
+
+    def undo(self) -> bool:
+        """
+        remove the last added row (or all the rows of the last `add_rows`), can be repeated until all the rows that
+        were added since the db was opened are removed
+        :return: True if a change was removed
+        """
+        with self._lock:
+            if len(self._undo_partitions) == 0:
+                return False
+            entry = self._undo_partitions.pop()
+            done = False
+            for partition in reversed(entry):
+                db = self._partition(partition)
+                if db.undo():
+                    done = True
+                    self._memory[partition] = db.memory_usage()
+            if done:
+                self._redo_partitions.append(entry)
+            return done
+
+    def redo(self) -> bool:
+        """
+        add back the last undone change, can be repeated until there are no undone changes (a new row clears them)
+        :return: True if a change was added back
+        """
+        with self._lock:
+            if len(self._redo_partitions) == 0:
+                return False
+            entry = self._redo_partitions.pop()
+            done = False
+            for partition in entry:
+                db = self._partition(partition)
+                if db.redo():
+                    done = True
+                    self._memory[partition] = db.memory_usage()
+                    self._evict()
+            if done:
+                self._undo_partitions.append(entry)
+            return done
+
+    def aggregate(self, loinc_code: str, range_valid: tuple[datetime.datetime, datetime.datetime],
+                  bucket: Union[str, datetime.timedelta] = "1D", as_of: Optional[datetime.datetime] = None
+                  ) -> pd.DataFrame:
+        """
+        like `MyDB.aggregate`, the statistics of every partition are combined. reads all the partitions, one at a time
+        within the memory budget
+        """
+        results = [self._partition(partition).aggregate(loinc_code, range_valid, bucket, as_of)
+                   for partition in range(self._partitions)]
+        if all(len(result) == 0 for result in results):
+            return results[0]
+        df = pd.concat([result for result in results if len(result) > 0], ignore_index=True)
+        df["Sum"] = df["Mean"] * df["Count"]
+        df = df.groupby(["Bucket start", "Unit"], sort=True).agg(
+            Count=("Count", "sum"), Sum=("Sum", "sum"), Min=("Min", "min"), Max=("Max", "max")).reset_index()
+        df["Mean"] = df["Sum"] / df["Count"]
+        return df[["Bucket start", "Unit", "Count", "Mean", "Min", "Max"]]
+
+    def distinct_values(self, column: str) -> list:
+        """
+        like `MyDB.distinct_values`, may include the values of rows that were undone
+        """
+        return list(self._distinct_column(column).values)
+
+    def search_values(self, column: str, prefix: str, limit: Optional[int] = 20) -> list:
+        """
+        like `MyDB.search_values`, may include the values of rows that were undone
+        """
+        return self._distinct_column(column).search_prefix(prefix, limit)
+
+    def _distinct_column(self, column: str) -> _DistinctValues:
+        if column not in _KEY_COLUMNS:
+            raise ValueError(f"no distinct values for the column {column!r}, only for {_KEY_COLUMNS}")
+        with self._lock:
+            if self._distinct is None:
+                # the values of every partition are in the dictionaries of its snapshot and in its log, without
+                # loading it
+                values = {col: set() for col in _KEY_COLUMNS}
+                for partition in range(self._partitions):
+                    path = _partition_path(self._directory, partition)
+                    meta = snapshot.load_meta(path)
+                    for col in _KEY_COLUMNS:
+                        values[col].update(meta["dictionaries"][col] if meta is not None else [])
+                    for record in wal.read_records(wal.log_path(path)):
+                        for row in record.get("rows", [record["row"]] if "row" in record else []):
+                            for col, value in zip(_COLUMNS, _decode_row(row)):
+                                if col in values:
+                                    values[col].add(value)
+                self._dictionaries = {col: _Dictionary(sorted(values[col])) for col in _KEY_COLUMNS}
+                self._distinct = {col: _DistinctValues(dictionary, np.arange(len(dictionary)))
+                                  for col, dictionary in self._dictionaries.items()}
+            return self._distinct[column]
+
+    def memory_usage(self) -> int:
+        """
+        :return: the approximate number of bytes of the loaded partitions (see `MyDB.memory_usage`)
+        """
+        with self._lock:
+            return sum(self._memory.values())
+
+    def cache_stats(self) -> dict:
+        """
+        :return: `MyDB.cache_stats` summed over the loaded partitions
+        """
+        with self._lock:
+            stats = [db.cache_stats() for db in self._loaded.values()]
+        total = {name: sum(s[name] for s in stats)
+                 for name in ("hits", "misses", "entries", "bytes", "max_bytes", "evictions", "invalidations")}
+        lookups = total["hits"] + total["misses"]
+        total["hit_rate"] = total["hits"] / lookups if lookups else None
+        return total
+
+    def set_cache_size(self, max_bytes: int):
+        """
+        :param max_bytes: the max bytes of the result cache of every partition, 0 disables the caches
+        """
+        with self._lock:
+            self._cache_size = max_bytes
+            for db in self._loaded.values():
+                db.set_cache_size(max_bytes)
+
+    def get_name_by_loinc(self, loinc: str) -> Optional[str]:
+        return self.loinc_catalog.name(loinc)
+
+    def close(self):
+        """
+        close all the loaded partitions
+        """
+        with self._lock:
+            while self._loaded:
+                _, db = self._loaded.popitem()
+                db.close()
+            self._memory.clear()
@@ -0,0 +1,289 @@
+"""
+local HTTP/JSON server of the API, one warm db for many clients
+every endpoint is a POST with a json object of the arguments:
+    /get_result   first_name, last_name, loinc, valid_date, valid_time, trans_date, trans_time
+    /get_history  first_name, last_name, loinc, valid_date, valid_time, start_date, start_time, end_date, end_time
+    /update       first_name, last_name, loinc, valid_date, valid_time, trans_date, trans_time, value
+    /delete       first_name, last_name, loinc, valid_date, valid_time, trans_date, trans_time
+the dates are YYYY-MM-DD and the times HH:MM[:SS], only valid_date is required
+the get_result requests that arrive together are answered with one bulk lookup, the get_history response is streamed
+"""
+import argparse
+import asyncio
+import datetime
+import json
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from api import API, to_rows
+
+# how long a get_result request waits for more requests to join its bulk lookup (seconds)
+_BATCH_DELAY = 0.002
+# the number of rows in every chunk of a streamed get_history response
+_HISTORY_CHUNK = 1000
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class RequestError(Exception):
+    """
+    a bad request, the message is sent to the client
+    """
+
+
+def _date(args: dict, name: str, required: bool = False) -> Optional[datetime.date]:
+    value = args.get(name)
+    if not value:
+        if required:
+            raise RequestError(f"{name} is mandatory")
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"{name} must be YYYY-MM-DD, got {value!r}")
+
+
+def _time(args: dict, name: str) -> Optional[datetime.time]:
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.time.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"{name} must be HH:MM[:SS], got {value!r}")
+
+
+def _key(args: dict) -> tuple[str, str, str]:
+    try:
+        return str(args["first_name"]), str(args["last_name"]), str(args["loinc"])
+    except KeyError as e:
+        raise RequestError(f"{e.args[0]} is mandatory")
+
+
+def _point(args: dict) -> tuple:
+    """
+    :return: the arguments of `API.get_res` from the json arguments
+    """
+    return (*_key(args), _date(args, "valid_date", required=True), _time(args, "valid_time"),
+            _date(args, "trans_date"), _time(args, "trans_time"))
+
+
+def _row(series) -> Optional[dict]:
+    """
+    :return: a row of the db as a json serializable dict, None if there is no row
+    """
+    if series is None:
+        return None
+    row = {}
+    for col, value in series.items():
+        if pd.isna(value):
+            value = None
+        elif isinstance(value, pd.Timestamp):
+            value = value.isoformat()
+        elif isinstance(value, np.generic):
+            value = value.item()
+        row[col] = value
+    return row
+
+
+class _ResultBatcher:
+    """
+    collects the get_result requests that arrive within `delay` and answers them with one `API.get_results_bulk`
+    """
+    def __init__(self, api: API, delay: float):
+        self._api = api
+        self._delay = delay
+        self._pending: list[tuple[tuple, asyncio.Future]] = []
+
+    async def get(self, query: tuple) -> Optional[dict]:
+        """
+        :param query: the arguments of `API.get_res`
+        :return: the result of the query, None if there is no result
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((query, future))
+        if len(self._pending) == 1:
+            loop.call_later(self._delay, lambda: asyncio.ensure_future(self._flush()))
+        return await future
+
+    async def _flush(self):
+        pending, self._pending = self._pending, []
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                None, self._api.get_results_bulk, [query for query, _ in pending])
+            for (_, future), (_, result) in zip(pending, results.iterrows()):
+                if future.done():
+                    continue
+                # a row that can't be converted fails only its own request
+                try:
+                    row = None if result.isna().all() else _row(result)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(row)
+        except Exception as e:
+            error = e
+        else:
+            error = RuntimeError("the bulk lookup returned no result for the request")
+        # every request of the batch is answered, even if the batch failed in the middle
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+
+class Server:
+    """
+    asyncio HTTP/1.1 server of the API (keep-alive, json requests and responses)
+    """
+    def __init__(self, api: Optional[API] = None, host: str = "127.0.0.1", port: int = 8080,
+                 batch_delay: float = _BATCH_DELAY):
+        """
+        :param api: the API to serve, a new one (that loads the db) if None
+        :param host: the address to listen on
+        :param port: the port to listen on, 0 for any free port
+        :param batch_delay: how long a get_result request waits for more requests to join its bulk lookup (seconds)
+        """
+        self.api = api if api is not None else API()
+        self.host = host
+        self.port = port
+        self._batcher = _ResultBatcher(self.api, batch_delay)
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._routes = {
+            "/get_result": self._get_result,
+            "/get_history": self._get_history,
+            "/update": self._update,
+            "/delete": self._delete,
+        }
+
+    async def start(self) -> int:
+        """
+        start listening
+        :return: the port the server listens on
+        """
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                await self._dispatch(writer, method, path, body)
+                if version == "HTTP/1.0" or headers.get("connection", "").lower() == "close":
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass  # a broken request or the client went away, nothing to answer
+        finally:
+            writer.close()
+
+    async def _dispatch(self, writer: asyncio.StreamWriter, method: str, path: str, body: bytes):
+        route = self._routes.get(path)
+        if route is None:
+            return await self._send(writer, 404, {"status": "error", "message": f"no such endpoint {path}"})
+        if method != "POST":
+            return await self._send(writer, 405, {"status": "error", "message": "use POST"})
+        try:
+            args = json.loads(body or b"{}")
+            if not isinstance(args, dict):
+                raise RequestError("the body must be a json object")
+            await route(writer, args)
+        except (RequestError, json.JSONDecodeError) as e:
+            await self._send(writer, 400, {"status": "error", "message": str(e)})
+        except (ConnectionError, asyncio.IncompleteReadError):
+            raise
+        except Exception as e:
+            await self._send(writer, 500, {"status": "error", "message": repr(e)})
+
+    @staticmethod
+    async def _send(writer: asyncio.StreamWriter, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    async def _run(function, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _get_result(self, writer: asyncio.StreamWriter, args: dict):
+        row = await self._batcher.get(_point(args))
+        if row is None:
+            return await self._send(writer, 404, {"status": "error", "message": "no result"})
+        await self._send(writer, 200, {"status": "success", "data": row})
+
+    async def _get_history(self, writer: asyncio.StreamWriter, args: dict):
+        history = await self._run(
+            self.api.get_history, *_key(args), _date(args, "valid_date", required=True), _time(args, "valid_time"),
+            _date(args, "start_date"), _time(args, "start_time"), _date(args, "end_date"), _time(args, "end_time"))
+
+        # one json document, sent in chunks so a long history is not built in memory as one string
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nTransfer-Encoding: chunked\r\n\r\n")
+
+        async def send_chunk(data: str):
+            data = data.encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            await writer.drain()
+
+        await send_chunk(json.dumps({"status": "success", "headers": list(history.columns)})[:-1] + ', "data": [')
+        for start in range(0, len(history), _HISTORY_CHUNK):
+            rows = to_rows(history.iloc[start:start + _HISTORY_CHUNK])
+            await send_chunk(("," if start > 0 else "") + ",".join(json.dumps(row) for row in rows))
+        await send_chunk("]}")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _change(self, writer: asyncio.StreamWriter, function, *args):
+        result = await self._run(function, *args)
+        if result is None:
+            return await self._send(writer, 404, {"status": "error", "message": "no result to change"})
+        await self._send(writer, 200, {"status": "success", "old": _row(result["old"]), "new": _row(result["new"])})
+
+    async def _update(self, writer: asyncio.StreamWriter, args: dict):
+        value = args.get("value")
+        if value is not None and not isinstance(value, str):
+            raise RequestError(f"value must be a string or null, got {value!r}")
+        await self._change(writer, self.api.update, *_point(args), value)
+
+    async def _delete(self, writer: asyncio.StreamWriter, args: dict):
+        await self._change(writer, self.api.delete, *_point(args))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="server", description="serve the db over HTTP/JSON")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="the port to listen on")
+    args = parser.parse_args()
+
+    server = Server(host=args.host, port=args.port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.api.close()
+
+
+if __name__ == '__main__':
+    main()
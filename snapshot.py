@@ -0,0 +1,196 @@
+"""
+binary columnar snapshot of the DB
+a snapshot is a directory with a .npy file for every column and a meta.json, the numeric columns are memory-mapped
+on load so opening a snapshot doesn't parse anything. the db keeps its coded and time columns mapped (only the
+"Value" column is decoded into memory) until new rows are merged into its frame
+"""
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+VERSION = 1
+_META_FILE = "meta.json"
+
+# the kinds of the values in the "Value" column
+_NONE = 0
+_INT = 1
+_FLOAT = 2
+_STR = 3
+
+
+def snapshot_path(db_path: Path) -> Path:
+    """
+    :param db_path: path to the xlsx for the db
+    :return: the path of the snapshot of the db, beside the xlsx
+    """
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.stem + ".snapshot")
+
+
+def is_fresh(path: Path, source: Path) -> bool:
+    """
+    :param path: the path of the snapshot
+    :param source: the file the snapshot was made from
+    :return: True if the snapshot exists and is newer than `source`
+    """
+    meta = Path(path) / _META_FILE
+    return meta.exists() and meta.stat().st_mtime >= Path(source).stat().st_mtime
+
+
+def load_meta(path: Path) -> Optional[dict]:
+    """
+    :param path: the path of the snapshot
+    :return: the meta data of the snapshot, None if there is no (complete) snapshot at `path`
+    """
+    try:
+        with open(Path(path) / _META_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _fsync_dir(path: Path):
+    """
+    make the creations, renames and deletions of entries in the directory durable
+    """
+    if os.name == "nt":
+        return  # windows can't open a directory to fsync it
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save(path: Path, columns: dict[str, np.ndarray], meta: dict):
+    """
+    write a snapshot, the old snapshot at `path` (if any) is replaced only after the new one is complete and durable,
+    so a crash leaves a complete snapshot at `path`, or at its ".tmp" / ".old" path for `recover`
+    :param path: the path of the snapshot
+    :param columns: the arrays to save by name, must not be of object dtype
+    :param meta: json serializable data to save with the arrays
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    old = path.with_name(path.name + ".old")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    for name, values in columns.items():
+        with open(tmp / f"{name}.npy", "wb") as f:
+            np.save(f, np.ascontiguousarray(values), allow_pickle=False)
+            f.flush()
+            os.fsync(f.fileno())
+    # the meta data is written last, a snapshot with a readable meta.json is complete
+    with open(tmp / _META_FILE, "w", encoding="utf-8") as f:
+        json.dump({"version": VERSION, "columns": list(columns), **meta}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    _fsync_dir(tmp)
+
+    shutil.rmtree(old, ignore_errors=True)
+    if path.exists():
+        path.rename(old)
+    tmp.rename(path)
+    _fsync_dir(path.parent)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def recover(path: Path):
+    """
+    finish or roll back a `save` that was interrupted by a crash: if there is no snapshot at `path`, the new snapshot
+    (if it is complete) or else the old one is moved there, and the leftovers are removed
+    :param path: the path of the snapshot
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    old = path.with_name(path.name + ".old")
+    if not path.exists():
+        for candidate in (tmp, old):
+            if candidate.exists() and load_meta(candidate) is not None:
+                candidate.rename(path)
+                _fsync_dir(path.parent)
+                break
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def load(path: Path) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    :param path: the path of the snapshot
+    :return: the arrays of the snapshot (memory-mapped, read only) by name and the meta data
+    """
+    path = Path(path)
+    with open(path / _META_FILE, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != VERSION:
+        raise ValueError(f"unsupported snapshot version {meta.get('version')} in {path}")
+    columns = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in meta["columns"]}
+    return columns, meta
+
+
+def encode_strings(values: np.ndarray) -> tuple[np.ndarray, list[str]]:
+    """
+    dictionary encoding of a string column
+    :return: the codes of the values and the dictionary
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes.astype(np.int32), uniques.tolist()
+
+
+def decode_strings(codes: np.ndarray, dictionary: list[str]) -> np.ndarray:
+    """
+    :return: object array of the strings of `codes`
+    """
+    return np.array(dictionary, dtype=object)[codes]
+
+
+def encode_values(values: np.ndarray) -> tuple[dict[str, np.ndarray], list[str]]:
+    """
+    encoding of the mixed "Value" column (None, int, float or str)
+    :return: the arrays of the encoding by name and the dictionary of the strings
+    :raise TypeError: if there is a value of other type
+    """
+    kinds = np.empty(len(values), dtype=np.int8)
+    numbers = np.zeros(len(values), dtype=np.float64)
+    integers = np.zeros(len(values), dtype=np.int64)
+    strings = np.full(len(values), -1, dtype=np.int32)
+    dictionary: dict[str, int] = {}
+
+    for i, value in enumerate(values):
+        if value is None:
+            kinds[i] = _NONE
+        elif isinstance(value, (bool, np.bool_)):
+            raise TypeError(f"cannot encode value {value!r} of type {type(value).__name__}")
+        elif isinstance(value, (int, np.integer)):
+            kinds[i] = _INT
+            integers[i] = value
+        elif isinstance(value, (float, np.floating)):
+            kinds[i] = _FLOAT
+            numbers[i] = value
+        elif isinstance(value, str):
+            kinds[i] = _STR
+            strings[i] = dictionary.setdefault(value, len(dictionary))
+        else:
+            raise TypeError(f"cannot encode value {value!r} of type {type(value).__name__}")
+
+    return {"kinds": kinds, "numbers": numbers, "integers": integers, "strings": strings}, list(dictionary)
+
+
+def decode_values(arrays: dict[str, np.ndarray], dictionary: list[str]) -> np.ndarray:
+    """
+    :return: object array of the values encoded with `encode_values`
+    """
+    kinds = arrays["kinds"]
+    values = np.full(len(kinds), None, dtype=object)
+    for kind, name in ((_INT, "integers"), (_FLOAT, "numbers")):
+        mask = kinds == kind
+        values[mask] = arrays[name][mask]
+    mask = kinds == _STR
+    values[mask] = decode_strings(arrays["strings"][mask], dictionary)
+    return values
@@ -0,0 +1,99 @@
+"""
+the undo journal of a persistent db survives a checkpoint that runs while rows are written
+run with `python -m unittest discover tests`
+"""
+import datetime
+import shutil
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import pandas as pd
+
+import myDB
+
+_XLSX = Path(__file__).resolve().parent.parent / "dbs" / "project_db_2025.xlsx"
+
+
+class UndoJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.db_path = self.directory / "db.xlsx"
+        shutil.copy(_XLSX, self.db_path)
+        self.loinc_path = self.directory / "loinc.csv"
+        pd.DataFrame({"LOINC_NUM": ["11218-5"], "LONG_COMMON_NAME": ["Microalbumin"]}).to_csv(self.loinc_path,
+                                                                                                index=False)
+        self.xlsx_rows = myDB.MyDB(self.db_path, self.loinc_path, persistent=False).df
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _open(self) -> myDB.MyDB:
+        return myDB.MyDB(self.db_path, self.loinc_path)
+
+    @staticmethod
+    def _add(db: myDB.MyDB, i: int):
+        db.add_row("Undo", f"Test{i % 7}", "11218-5", datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=i),
+                   datetime.datetime(2021, 1, 1), str(i), "mg")
+
+    def _assert_undo_to_xlsx(self, db: myDB.MyDB):
+        self.assertEqual(sum(db._undo_sizes), len(db) - db._undo_floor)
+        while db.undo():
+            pass
+        pd.testing.assert_frame_equal(db.df.reset_index(drop=True), self.xlsx_rows.reset_index(drop=True))
+
+    def test_rows_written_during_a_checkpoint_are_not_in_its_journal(self):
+        db = self._open()
+        for i in range(10):
+            self._add(db, i)
+
+        write_snapshot = myDB._write_snapshot
+
+        def write_after_more_rows(*args):
+            # the rows land after the state was captured and before it is written
+            for i in range(10, 14):
+                self._add(db, i)
+            write_snapshot(*args)
+
+        with mock.patch.object(myDB, "_write_snapshot", write_after_more_rows):
+            db.checkpoint()
+        db.close()
+
+        db = self._open()
+        self.assertEqual(len(db), len(self.xlsx_rows) + 14)
+        self._assert_undo_to_xlsx(db)
+        db.close()
+
+    def test_concurrent_writers_and_checkpoints(self):
+        db = self._open()
+        stop = threading.Event()
+
+        def checkpoints():
+            while not stop.is_set():
+                db.checkpoint()
+
+        def writer(first: int):
+            for i in range(first, first + 150):
+                self._add(db, i)
+
+        checkpointer = threading.Thread(target=checkpoints)
+        checkpointer.start()
+        writers = [threading.Thread(target=writer, args=(n * 1000,)) for n in range(3)]
+        for thread in writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        checkpointer.join()
+        db.close()
+
+        db = self._open()
+        self.assertEqual(len(db), len(self.xlsx_rows) + 450)
+        self._assert_undo_to_xlsx(db)
+        db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
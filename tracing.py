@@ -0,0 +1,239 @@
+"""
+in-process latency tracing and profiling hooks
+the stages of the operations are wrapped in named spans (`span`, `traced`), when tracing is enabled the duration of
+every span is added to a histogram of its name, `stats` / `format_stats` report them. when tracing is disabled (the
+default) a span costs one check of a global flag
+tracing is enabled by `enable` or by setting the environment variable MYDB_TRACE=1
+"""
+import cProfile
+import collections
+import contextlib
+import functools
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Optional
+
+# the number of histogram buckets, bucket i counts the durations in [2^(i-1), 2^i) microseconds
+_BUCKETS = 40
+
+_enabled = os.environ.get("MYDB_TRACE", "") not in ("", "0")
+_lock = threading.Lock()
+
+
+class _Histogram:
+    """
+    the count, total, min, max and log2 buckets of the durations of a span
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * _BUCKETS
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[min(int(seconds * 1_000_000).bit_length(), _BUCKETS - 1)] += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        :return: the upper bound (seconds) of the bucket of the q-th percentile, at most the max
+        """
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank and count > 0:
+                return min((1 << i) / 1_000_000, self.max)
+        return self.max
+
+
+_histograms: dict[str, _Histogram] = {}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def record(name: str, seconds: float):
+    """
+    add a duration to the histogram of `name`
+    """
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.add(seconds)
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.start)
+
+
+_NO_SPAN = contextlib.nullcontext()
+
+
+def span(name: str):
+    """
+    :return: context manager that records its duration under `name` (if tracing is enabled)
+    """
+    return _Span(name) if _enabled else _NO_SPAN
+
+
+def traced(name: str) -> Callable:
+    """
+    decorator that records the duration of every call of the function under `name` (if tracing is enabled)
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def stats() -> dict[str, dict]:
+    """
+    :return: by span name: the number of calls, and the total, mean, min, p50, p90, p99 and max durations in ms
+    """
+    with _lock:
+        return {
+            name: {
+                "count": histogram.count,
+                "total_ms": histogram.total * 1000,
+                "mean_ms": histogram.total / histogram.count * 1000,
+                "min_ms": histogram.min * 1000,
+                "p50_ms": histogram.percentile(50) * 1000,
+                "p90_ms": histogram.percentile(90) * 1000,
+                "p99_ms": histogram.percentile(99) * 1000,
+                "max_ms": histogram.max * 1000,
+            }
+            for name, histogram in sorted(_histograms.items())
+        }
+
+
+def format_stats() -> str:
+    """
+    :return: `stats` as a table, the percentiles are the upper bounds of their log2 buckets
+    """
+    columns = ["count", "total_ms", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+    rows = stats()
+    if not rows:
+        return "no spans were recorded" + ("" if _enabled else " (tracing is disabled)")
+    width = max(len(name) for name in rows)
+    lines = [f"{'span':<{width}} " + " ".join(f"{col:>10}" for col in columns)]
+    for name, row in rows.items():
+        lines.append(f"{name:<{width}} {row['count']:>10} "
+                     + " ".join(f"{row[col]:>10.3f}" for col in columns[1:]))
+    return "\n".join(lines)
+
+
+def reset():
+    """
+    drop all the recorded durations
+    """
+    with _lock:
+        _histograms.clear()
+
+
+class _Sampler(threading.Thread):
+    """
+    samples the stacks of all the other threads every `interval` seconds
+    """
+    def __init__(self, interval: float):
+        super().__init__(name="tracing-sampler", daemon=True)
+        self.interval = interval
+        self.stacks: collections.Counter[str] = collections.Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+# the running profiler and the path of its output
+_profiler: Optional[tuple[object, Path]] = None
+
+
+def start_profiling(path: Path, sampling: bool = True, interval: float = 0.005):
+    """
+    start a profiler, its output is written to `path` by `stop_profiling`
+    :param path: the output file
+    :param sampling: sample the stacks of all the threads every `interval` seconds and write them in the collapsed
+                     stacks format of flamegraph.pl / speedscope ("frame;frame;frame count" per line), otherwise run
+                     cProfile on the calling thread only and write its pstats file
+    :param interval: the seconds between samples
+    """
+    global _profiler
+    if _profiler is not None:
+        raise RuntimeError("a profiler is already running")
+    if sampling:
+        profiler = _Sampler(interval)
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    _profiler = (profiler, Path(path))
+
+
+def stop_profiling() -> Path:
+    """
+    stop the profiler of `start_profiling` and write its output
+    :return: the path of the output
+    """
+    global _profiler
+    if _profiler is None:
+        raise RuntimeError("no profiler is running")
+    (profiler, path), _profiler = _profiler, None
+    if isinstance(profiler, _Sampler):
+        profiler.stop()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in profiler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+    else:
+        profiler.disable()
+        profiler.dump_stats(path)
+    return path
@@ -0,0 +1,183 @@
+"""
+append-only write-ahead log of the changes to the DB
+every record is a json line with a log sequence number (lsn), the writers only write to the file buffer and a flusher
+thread fsyncs all the records that were written since the last fsync at once (group commit)
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+
+def log_path(db_path: Path) -> Path:
+    """
+    :param db_path: path to the xlsx for the db
+    :return: the path of the write-ahead log of the db, beside the xlsx
+    """
+    db_path = Path(db_path)
+    return db_path.with_name(db_path.stem + ".wal")
+
+
+def _read(path: Path) -> tuple[list[dict], int]:
+    """
+    :return: the records of the log and the length in bytes of the valid part of the file,
+             a torn record at the end of the file (crash in the middle of a write) is not valid
+    """
+    records = []
+    valid_length = 0
+    if not path.exists():
+        return records, valid_length
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            valid_length += len(line)
+    return records, valid_length
+
+
+def _fsync_dir(path: Path):
+    """
+    make the replacement of a file in the directory durable
+    """
+    if os.name == "nt":
+        return  # windows can't open a directory to fsync it
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_records(path: Path) -> list[dict]:
+    """
+    :param path: the path of a log file
+    :return: the valid records in the file, without opening it for writing
+    """
+    return _read(Path(path))[0]
+
+
+class WriteAheadLog:
+    """
+    write-ahead log with group commit
+    """
+    def __init__(self, path: Path, min_lsn: int = 0, commit_delay: float = 0.002):
+        """
+        :param path: the path of the log file, created if it doesn't exist
+        :param min_lsn: the lsn of the last record that was already folded into a snapshot, new records get bigger lsns
+        :param commit_delay: how long the flusher waits for more records before an fsync (seconds)
+        """
+        self.path = Path(path)
+        self._commit_delay = commit_delay
+
+        records, valid_length = _read(self.path)
+        with open(self.path, "ab") as f:
+            f.truncate(valid_length)
+        self._lsn = max([min_lsn] + [record["lsn"] for record in records])
+        self._synced_lsn = self._lsn
+        self.size = len(records)
+
+        self._file = open(self.path, "ab")
+        self._cond = threading.Condition()
+        # taken while fsyncing or replacing `_file`
+        self._sync_lock = threading.Lock()
+        self._closed = False
+        self._flusher = threading.Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+        self._flusher.start()
+
+    @property
+    def lsn(self) -> int:
+        """
+        the lsn of the last record that was appended
+        """
+        return self._lsn
+
+    def records(self, after_lsn: int = 0) -> list[dict]:
+        """
+        :return: the records in the log with lsn bigger than `after_lsn`
+        """
+        with self._cond:
+            self._file.flush()
+            records, _ = _read(self.path)
+        return [record for record in records if record["lsn"] > after_lsn]
+
+    def append(self, record: dict) -> int:
+        """
+        write a record to the log, the record is durable only after `wait` returns for its lsn
+        :param record: json serializable dict
+        :return: the lsn of the record
+        """
+        with self._cond:
+            if self._closed:
+                raise ValueError("the write-ahead log is closed")
+            self._lsn += 1
+            self._file.write((json.dumps({"lsn": self._lsn, **record}) + "\n").encode("utf-8"))
+            self.size += 1
+            self._cond.notify_all()
+            return self._lsn
+
+    def wait(self, lsn: int):
+        """
+        block until the record `lsn` (and all the records before it) is fsynced
+        """
+        with self._cond:
+            while self._synced_lsn < lsn:
+                self._cond.wait()
+
+    def truncate(self, lsn: int):
+        """
+        remove the records up to `lsn` (that were folded into a snapshot) from the log
+        """
+        with self._sync_lock, self._cond:
+            self._file.flush()
+            records, _ = _read(self.path)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with open(tmp, "wb") as f:
+                for record in records:
+                    if record["lsn"] > lsn:
+                        f.write((json.dumps(record) + "\n").encode("utf-8"))
+                f.flush()
+                os.fsync(f.fileno())
+            self._file.close()
+            os.replace(tmp, self.path)
+            _fsync_dir(self.path.parent)
+            self._file = open(self.path, "ab")
+            self.size = sum(record["lsn"] > lsn for record in records)
+            self._synced_lsn = self._lsn
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        fsync the remaining records and stop the flusher
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+        self._file.close()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._synced_lsn == self._lsn and not self._closed:
+                    self._cond.wait()
+                if self._synced_lsn == self._lsn:
+                    return
+
+            # let more writers join this fsync
+            time.sleep(self._commit_delay)
+
+            with self._sync_lock:
+                with self._cond:
+                    self._file.flush()
+                    lsn = self._lsn
+                os.fsync(self._file.fileno())
+            with self._cond:
+                self._synced_lsn = max(self._synced_lsn, lsn)
+                self._cond.notify_all()
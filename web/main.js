@@ -7,6 +7,85 @@ function waitForPywebview(callback) {
 }
 
 
+// the id of the last submitted query
+let lastQuery = 0;
+
+
+// the max number of suggestions in a datalist
+const SUGGESTIONS = 50;
+
+
+// fill `list` with the values from `fetchValues(prefix, limit)` that start with the value of `input`, refreshed
+// shortly after the user stops typing
+function bindAutocomplete(input, list, fetchValues)
+{
+    let timer = null;
+    let request = 0;
+    const refresh = async () => {
+        const current = ++request;
+        const values = await fetchValues(input.value, SUGGESTIONS);
+        if(current !== request)
+        {
+            return; // the user typed more while this one was fetched
+        }
+        list.replaceChildren(...values.map(value => {
+            const opt = document.createElement("option");
+            opt.value = value;
+            return opt;
+        }));
+    };
+    input.addEventListener("input", () => {
+        clearTimeout(timer);
+        timer = setTimeout(refresh, 150);
+    });
+    refresh();
+}
+
+
+function appendRows(tableBody, rows)
+{
+    const fragment = document.createDocumentFragment();
+    rows.forEach((rowData) => {
+        const row = document.createElement('tr');
+        rowData.forEach((cellData) => {
+            const cell = document.createElement('td');
+            cell.textContent = cellData;
+            row.appendChild(cell);
+        });
+        fragment.appendChild(row);
+    });
+    tableBody.appendChild(fragment);
+}
+
+
+// fetch the rest of a long result page by page, rendering every page before fetching the next one so the window
+// stays responsive, stops when a newer query was submitted
+async function appendPages(tableBody, cursor, offset, query)
+{
+    while(true)
+    {
+        const page = await pywebview.api.get_page(cursor, offset);
+        if(query !== lastQuery)
+        {
+            pywebview.api.close_cursor(cursor);
+            return;
+        }
+        if(page.status == "error")
+        {
+            console.error(page.message);
+            return;
+        }
+        appendRows(tableBody, page.data);
+        if(page.done)
+        {
+            return;
+        }
+        offset += page.data.length;
+        await new Promise(resolve => requestAnimationFrame(resolve));
+    }
+}
+
+
 async function main()
 {
     document.body.style.userSelect = 'text';
@@ -60,31 +139,13 @@ async function main()
         historyFields.style.display = 'block';
       }
     });
-    fnameList = document.getElementById("fnameList");
-    fnames = await pywebview.api.get_fnames();
-    fnameList.append(...fnames.map(name => {
-        const opt = document.createElement("option");
-        opt.value = name;
-        return opt;
-    }));
-
-    lnameList = document.getElementById("lnameList");
-    lnames = await pywebview.api.get_lnames();
-    lnameList.append(...lnames.map(name => {
-        const opt = document.createElement("option");
-        opt.value = name;
-        return opt;
-    }));
-
-    loincList = document.getElementById("loincList");
-    loincs = await pywebview.api.get_loinc();
-    loincList.append(...loincs.map(loinc => {
-        const opt = document.createElement("option");
-        opt.value = loinc;
-        return opt;
-    }));
+    // the suggestions are only the values that start with what was typed, fetched as the user types
+    bindAutocomplete(firstNameInput, document.getElementById("fnameList"), (prefix, limit) => pywebview.api.get_fnames(prefix, limit));
+    bindAutocomplete(lastNameInput, document.getElementById("lnameList"), (prefix, limit) => pywebview.api.get_lnames(prefix, limit));
+    bindAutocomplete(loincNumberInput, document.getElementById("loincList"), (prefix, limit) => pywebview.api.get_loinc(prefix, limit));
 
     document.getElementById("submitBtn").addEventListener("click", async () => {
+        const query = ++lastQuery;
         const selectedAction = actionSelect.value;
         let data = null;
         switch (selectedAction) {
@@ -122,6 +183,10 @@ async function main()
                 console.error("Unknown action:", selectedAction);
                 return;
             }
+            if(query !== lastQuery)
+            {
+                return; // a newer query was submitted while this one ran
+            }
             errorMsg.classList.add("d-none");
             message.classList.add("d-none");
             table.classList.add("d-none");
@@ -148,18 +213,12 @@ async function main()
                         tableHeaders.appendChild(th);
                       });
 
-                      // Add data rows to the table
-                      data.data.data.forEach((rowData, rowIndex) => {
-                        const row = document.createElement('tr');
-
-                        rowData.forEach((cellData, cellIndex) => {
-                          const cell = document.createElement('td');
-                          cell.textContent = cellData;
-                          row.appendChild(cell);
-                        });
-
-                        tableData.appendChild(row);
-                      });
+                      // Add data rows to the table, a long result comes in pages that are appended as they arrive
+                      appendRows(tableData, data.data.data);
+                      if(data.data.cursor !== null && data.data.cursor !== undefined)
+                      {
+                          await appendPages(tableData, data.data.cursor, data.data.data.length, query);
+                      }
                 }
             }
             console.log(data);
@@ -1,9 +1,19 @@
-import pandas as pd
+import itertools
+import threading
+
 import webview
 from pandas import Series, DataFrame
-from api import API
+import tracing
+from api import API, to_rows
 from datetime import time, datetime
 
+# the number of rows of a long result that are sent to the page in one call
+PAGE_SIZE = 500
+# the max number of results that are kept for paging at once, the oldest are dropped first
+_MAX_CURSORS = 8
+
+
+@tracing.traced("webview.parse_html_date")
 def parse_html_date(date_str: str):
     """
     Convert a string from an HTML date input to datetime.date.
@@ -17,6 +27,7 @@ def parse_html_date(date_str: str):
         return None
 
 
+@tracing.traced("webview.parse_html_time")
 def parse_html_time(time_str: str) -> time | None:
     """
     Convert a string from an HTML time input to datetime.time.
@@ -34,6 +45,7 @@ def parse_html_time(time_str: str) -> time | None:
     return None  # if no format matched
 
 
+@tracing.traced("webview.to_dict")
 def to_dict(df: DataFrame | Series | None):
     """
     Convert a DataFrame or a Series (single row) to a dictionary with headers and data.
@@ -44,42 +56,92 @@ def to_dict(df: DataFrame | Series | None):
             "data": list of rows (each row is a list of values)
         }
     """
-
-    def convert_datetime(val):
-        """Convert datetime.date or datetime.time to string."""
-        if isinstance(val, pd.Timestamp):
-            return val.isoformat()  # Converts to 'YYYY-MM-DD' or 'HH:MM:SS'
-        return val
-
     if df is None:
         return None
 
     if isinstance(df, DataFrame):
         return {
             "headers": list(df.columns.to_list()),
-            "data": df.map(convert_datetime).values.tolist()  # list of lists
+            "data": to_rows(df)  # list of lists
         }
     elif isinstance(df, Series):
         return {
             "headers": df.index.tolist(),
-            "data": [df.apply(convert_datetime).tolist()]  # single row wrapped in a list
+            "data": to_rows(df.to_frame().T.infer_objects())  # single row as a one row frame
         }
     else:
         raise TypeError("Input must be a pandas DataFrame or Series")
 
 
 class WebViewAPI:
-    def __init__(self):
-        self.__api = API()
+    def __init__(self, api: API):
+        """
+        :param api: the API the window works with, the caller releases it when the window is closed
+        """
+        self.__api = api
+        self.__cursors: dict[int, DataFrame] = {}
+        self.__cursor_ids = itertools.count()
+        self.__cursors_lock = threading.Lock()
+
+    def __open_cursor(self, df: DataFrame, page_size: int) -> dict:
+        """
+        keep `df` for paging and convert its first page
+        :return: like `to_dict` of the first page, with the cursor of the rest of the rows and the number of rows
+        """
+        result = to_dict(df.iloc[:page_size])
+        result["total"] = len(df)
+        result["cursor"] = None
+        if len(df) > page_size:
+            with self.__cursors_lock:
+                cursor = next(self.__cursor_ids)
+                self.__cursors[cursor] = df
+                while len(self.__cursors) > _MAX_CURSORS:
+                    del self.__cursors[next(iter(self.__cursors))]
+            result["cursor"] = cursor
+        return result
+
+    @tracing.traced("webview.get_page")
+    def get_page(self, cursor: int, offset: int, page_size: int = PAGE_SIZE):
+        """
+        the next rows of a long result
+        :param cursor: the cursor that was returned with the first page
+        :param offset: the index of the first row of the page
+        :param page_size: the max number of rows in the page
+        :return: {"status", "data": list of rows, "done": whether this is the last page}, the cursor is closed after
+                 its last page
+        """
+        with self.__cursors_lock:
+            df = self.__cursors.get(cursor)
+        if df is None:
+            return {
+                "status": "error",
+                "message": "the result is no longer available, please run the query again"
+            }
 
-    def get_fnames(self):
-        return self.__api.get_all_first_names()
+        done = offset + page_size >= len(df)
+        if done:
+            self.close_cursor(cursor)
+        return {
+            "status": "success",
+            "data": to_rows(df.iloc[offset:offset + page_size]),
+            "done": done
+        }
+
+    def close_cursor(self, cursor: int):
+        """
+        drop a result that is no longer paged
+        """
+        with self.__cursors_lock:
+            self.__cursors.pop(cursor, None)
 
-    def get_lnames(self):
-        return self.__api.get_all_last_names()
+    def get_fnames(self, prefix: str = "", limit: int | None = None):
+        return self.__api.get_all_first_names(prefix, limit)
 
-    def get_loinc(self):
-        return self.__api.get_all_loinc()
+    def get_lnames(self, prefix: str = "", limit: int | None = None):
+        return self.__api.get_all_last_names(prefix, limit)
+
+    def get_loinc(self, prefix: str = "", limit: int | None = None):
+        return self.__api.get_all_loinc(prefix, limit)
 
     def get_result(self, first_name: str, last_name: str, loinc: str,
             valid_data: str, valid_time: str,
@@ -220,7 +282,11 @@ class WebViewAPI:
     def get_history(self, first_name: str, last_name: str, loinc: str,
             valid_data: str, valid_time: str,
             trans_start_date: str, trans_start_time: str,
-            trans_end_date: str, trans_end_time: str):
+            trans_end_date: str, trans_end_time: str, page_size: int = PAGE_SIZE):
+        """
+        the rows come in pages, the first `page_size` rows are in "data" and the rest are read with `get_page`
+        using "cursor" (None if there are no more rows), "total" is the number of rows
+        """
 
         valid_data = parse_html_date(valid_data)
         valid_time = parse_html_time(valid_time)
@@ -260,15 +326,17 @@ class WebViewAPI:
             "status": "success",
             "message": f"the {loinc} ({loinc_name}) test result of {first_name} {last_name} from {valid_data} {valid_time if valid_time is not None else ''}"
                        f" in Transaction time : [{trans_start_str}, {trans_end_str}]:",
-            "data": to_dict(res)
+            "data": self.__open_cursor(res, page_size)
         }
 
 
 def main():
-    global myAPI
-    myAPI = API()
-    webview.create_window("Database Management", "web/index.html", js_api=WebViewAPI())
-    webview.start(debug=False)
+    api = API()
+    try:
+        webview.create_window("Database Management", "web/index.html", js_api=WebViewAPI(api))
+        webview.start(debug=False)
+    finally:
+        api.close()
 
 
 